@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+"""Benchmarks for listing and creating blog posts with archives of 
+different sizes. The results are written as JSON so they can be compared
+between revisions.
+
+    python -m benchmarks.blog [--posts=100,1000,10000] [--repeat=5] [--output=FILE]
+
+For every benchmark the per-call latency (in milliseconds), the number of
+SQL statements per call and the peak memory usage of the process (maximum
+resident set size in KB, which can only grow during a run) are reported.
+"""
+
+import datetime
+import gc
+from optparse import OptionParser
+import resource
+import sys
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import trac
+from trac.web.api import RequestDone
+
+from trac_wiki_blog.cache import BlogCache, RenderCache
+from trac_wiki_blog.macro import ShowPostsMacro
+from trac_wiki_blog.util import load_pages_with_tags, sort_by_creation_date
+from trac_wiki_blog.web_ui import NewPostModule
+
+from benchmarks.environment import blog_environment, count_queries, web_request
+
+
+class Formatter(object):
+    def __init__(self, req):
+        self.req = req
+        self.context = None
+
+
+def peak_memory():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(function, repetitions, query_counter, setup=None):
+    """Call the function several times and return the timing statistics."""
+    timings = []
+    queries = []
+    for i in range(repetitions):
+        if setup is not None:
+            setup()
+        gc.collect()
+        queries_before = query_counter.queries
+        start = time.time()
+        function()
+        timings.append((time.time() - start) * 1000)
+        queries.append(query_counter.queries - queries_before)
+    timings.sort()
+    return dict(
+        calls = repetitions,
+        min_ms = round(timings[0], 3),
+        median_ms = round(timings[len(timings) // 2], 3),
+        max_ms = round(timings[-1], 3),
+        queries_per_call = max(queries),
+        peak_rss_kb = peak_memory(),
+    )
+
+
+def benchmark_archive(number_of_posts, repetitions):
+    env = blog_environment(number_of_posts)
+    query_counter = count_queries(env)
+    macro = ShowPostsMacro(env)
+    results = {}
+    
+    def load_pages():
+        return load_pages_with_tags(env, web_request(env, '/'), 'blog')
+    results['load_pages_with_tags'] = measure(load_pages, repetitions, query_counter)
+    
+    pages = load_pages()
+    results['sort_by_creation_date'] = measure(lambda: sort_by_creation_date(pages),
+                                               repetitions, query_counter)
+    pages[:] = []
+    
+    def expand_macro():
+        formatter = Formatter(web_request(env, '/wiki/Blog'))
+        return macro.expand_macro(formatter, 'ShowPosts', '')
+    def clear_caches():
+        RenderCache(env).clear()
+        BlogCache(env).invalidate()
+        macro._parsed_posts.clear()
+    results['expand_macro_cold'] = measure(expand_macro, repetitions, 
+                                           query_counter, setup=clear_caches)
+    expand_macro()
+    results['expand_macro_warm'] = measure(expand_macro, repetitions, query_counter)
+    
+    new_post_module = NewPostModule(env)
+    def show_editor():
+        new_post_module.process_request(web_request(env, '/newblogpost'))
+    results['new_post_form'] = measure(show_editor, repetitions, query_counter)
+    
+    titles = iter(range(repetitions))
+    def save_post():
+        req = web_request(env, '/newblogpost', method='POST', 
+                          blogtitle='Benchmark Post %d' % titles.next(),
+                          text='Some text', tags='benchmark', version='0',
+                          save='Submit')
+        try:
+            new_post_module.process_request(req)
+        except RequestDone:
+            pass
+    results['new_post_save'] = measure(save_post, repetitions, query_counter)
+    return results
+
+
+def run(archive_sizes, repetitions):
+    report = dict(
+        created = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        python = sys.version.split()[0],
+        trac = trac.__version__,
+        repetitions = repetitions,
+        archives = [],
+    )
+    for number_of_posts in archive_sizes:
+        start = time.time()
+        results = benchmark_archive(number_of_posts, repetitions)
+        sys.stderr.write('%d posts: %.1f s\n' % (number_of_posts, time.time() - start))
+        report['archives'].append(dict(posts=number_of_posts, benchmarks=results))
+    return report
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--posts', default='100,1000,10000',
+                      help='comma-separated list of archive sizes')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='number of calls per benchmark')
+    parser.add_option('--output', default=None,
+                      help='write the JSON report to this file (default: stdout)')
+    options, args = parser.parse_args(argv)
+    archive_sizes = [int(size) for size in options.posts.split(',')]
+    
+    report = json.dumps(run(archive_sizes, options.repeat), indent=2, sort_keys=True)
+    if options.output:
+        output = open(options.output, 'w')
+        try:
+            output.write(report + '\n')
+        finally:
+            output.close()
+    else:
+        print report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+"""Creates Trac environments with many blog posts for the benchmarks."""
+
+from StringIO import StringIO
+import datetime
+import random
+
+from trac.perm import PermissionCache, PermissionSystem
+from trac.test import EnvironmentStub
+from trac.util.datefmt import utc
+from trac.web.api import Request
+from trac.web.chrome import Chrome
+from trac.web.main import RequestDispatcher
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.stats import CountingConnection, QueryCounter
+from trac_wiki_blog.util import get_wiki_pagename, to_utimestamp
+
+
+__all__ = ['blog_environment', 'count_queries', 'web_request']
+
+
+words = ('trac wiki blog post release plugin ticket milestone python '
+         'database query cache render template macro feature bug fix '
+         'performance archive feed page user permission').split()
+
+def _sentence(rng, number_of_words):
+    return ' '.join([rng.choice(words) for i in range(number_of_words)]).capitalize() + '.'
+
+def post_markup(rng, title):
+    """Return the wiki markup for a post with a size between 2 and 8 KB 
+    (which is typical for blog posts) using common wiki formatting."""
+    lines = ['= %s =' % title, '']
+    size = rng.randint(2048, 8192)
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.1:
+            block = ['== %s ==' % _sentence(rng, 3)[:-1]]
+        elif kind < 0.2:
+            block = [' * %s' % _sentence(rng, 6) for i in range(rng.randint(2, 5))]
+        elif kind < 0.25:
+            block = ['{{{', '#!python', 'def %s():' % rng.choice(words), 
+                     '    return %d' % rng.randint(0, 100), '}}}']
+        else:
+            block = [' '.join([_sentence(rng, rng.randint(5, 15)) for i in range(4)]),
+                     'See [wiki:WikiStart], ticket #%d and \'\'%s\'\'.' % 
+                     (rng.randint(1, 500), rng.choice(words))]
+        lines.extend(block + [''])
+        length += sum([len(line) + 1 for line in block])
+    return '\n'.join(lines)
+
+def blog_environment(number_of_posts, seed=42):
+    """Return an in-memory environment which contains the given number of 
+    blog posts (each with one to three versions and some tags). The pages
+    are inserted directly into the database as going through the wiki and
+    tag APIs would take very long for large archives."""
+    env = EnvironmentStub(default_data=True, enable=('trac.*', 'tractags.*', 
+                                                     'trac_wiki_blog.*'))
+    env.upgrade()
+    PermissionSystem(env).grant_permission('admin', 'TRAC_ADMIN')
+    rng = random.Random(seed)
+    db = env.get_db_cnx()
+    cursor = db.cursor()
+    first_post = datetime.datetime(2005, 1, 1, tzinfo=utc)
+    for i in range(number_of_posts):
+        created = first_post + datetime.timedelta(hours=rng.randint(0, 24*365*6))
+        title = '%s %d' % (_sentence(rng, 4)[:-1], i)
+        name = get_wiki_pagename(created, title)
+        for version in range(1, rng.randint(1, 3) + 1):
+            changed = created + datetime.timedelta(days=version - 1)
+            cursor.execute("INSERT INTO wiki (name, version, time, author, ipnr, "
+                           "text, comment, readonly) VALUES (%s, %s, %s, %s, %s, "
+                           "%s, %s, %s)", (name, version, to_utimestamp(changed),
+                           'admin', '127.0.0.1', post_markup(rng, title), '', 0))
+        tags = ['blog'] + rng.sample(['release', 'security', 'howto', 'news', 
+                                      'draft'], rng.randint(0, 2))
+        for tag in tags:
+            cursor.execute("INSERT INTO tags (tagspace, name, tag) VALUES "
+                           "(%s, %s, %s)", ('wiki', name, tag))
+    BlogPostIndex(env).rebuild(db)
+    db.commit()
+    return env
+
+
+def web_request(env, path, method='GET', authname='admin', **args):
+    """Return a request which can be processed by the request handlers of the
+    given environment without going through the RequestDispatcher."""
+    environ = {'REQUEST_METHOD': method, 'SERVER_NAME': 'localhost', 
+               'SERVER_PORT': '80', 'SCRIPT_NAME': '', 'PATH_INFO': path, 
+               'QUERY_STRING': '', 'wsgi.url_scheme': 'http', 
+               'wsgi.input': StringIO(), 'HTTP_COOKIE': 'trac_form_token=token'}
+    req = Request(environ, lambda status, headers, exc_info=None: lambda data: None)
+    dispatcher = RequestDispatcher(env)
+    req.callbacks.update({
+        'authname': lambda req: authname,
+        'chrome': Chrome(env).prepare_request,
+        'perm': lambda req: PermissionCache(env, authname),
+        'session': dispatcher._get_session,
+        'locale': dispatcher._get_locale,
+        'tz': dispatcher._get_timezone,
+        'form_token': lambda req: 'token',
+    })
+    req.args.update(args)
+    return req
+
+
+def count_queries(env):
+    """Count all SQL statements executed in the given environment. Returns a 
+    QueryCounter whose attribute 'queries' is the current number of 
+    statements."""
+    counter = QueryCounter()
+    get_db_cnx, get_read_db = env.get_db_cnx, env.get_read_db
+    env.get_db_cnx = lambda *args: CountingConnection(get_db_cnx(*args), counter)
+    env.get_read_db = lambda *args: CountingConnection(get_read_db(*args), counter)
+    return counter
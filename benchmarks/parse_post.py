@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+"""Micro-benchmark for parse_post() which shows that parsing time grows 
+linearly with the size of the wiki markup (also for pages without a title
+which made the old regular expression backtrack).
+
+    python -m benchmarks.parse_post [megabytes]
+"""
+
+import re
+import sys
+import time
+
+from trac_wiki_blog.util import parse_post
+
+
+# the expression used before parse_post() was introduced
+old_parsing_regex = re.compile(r'.*?^\s*=+\s+([^\n\r]+?)\s+=+\s*(.*?$.*)',
+                               re.MULTILINE|re.DOTALL)
+
+def regular_post(size):
+    paragraph = u'Some text with a [wiki:Link link] and \'\'emphasis\'\'.\n\n'
+    return u'= Title =\n\n' + paragraph * (size / len(paragraph))
+
+def post_without_title(size):
+    line = u'a line without any heading\n'
+    return line * (size / len(line))
+
+def blank_lines_without_title(size):
+    return u'\n' * size + u'x'
+
+def unterminated_headings(size):
+    line = u'= heading without end' + u' ' * 200 + u'\n'
+    return line * (size / len(line))
+
+inputs = [
+    ('regular post', regular_post),
+    ('no title', post_without_title),
+    ('blank lines', blank_lines_without_title),
+    ('unterminated headings', unterminated_headings),
+]
+
+def parse(markup):
+    try:
+        parse_post(markup)
+    except ValueError:
+        pass
+
+def parse_with_old_regex(markup):
+    old_parsing_regex.match(markup)
+
+def duration(function, markup, repetitions=3):
+    """Return the best time (in seconds) of several calls."""
+    timings = []
+    for i in range(repetitions):
+        start = time.time()
+        function(markup)
+        timings.append(time.time() - start)
+    return min(timings)
+
+def run(max_megabytes=8):
+    sizes = []
+    megabytes = 1
+    while megabytes <= max_megabytes:
+        sizes.append(megabytes)
+        megabytes *= 2
+    
+    is_linear = True
+    print '%-22s %8s %12s %12s' % ('input', 'MB', 'seconds', 'seconds/MB')
+    for name, generate in inputs:
+        seconds_per_megabyte = []
+        for megabytes in sizes:
+            markup = generate(megabytes * 1024 * 1024)
+            seconds = duration(parse, markup)
+            seconds_per_megabyte.append(seconds / megabytes)
+            print '%-22s %8d %12.4f %12.4f' % (name, megabytes, seconds, 
+                                               seconds / megabytes)
+        # allow for some noise but a quadratic algorithm would take 
+        # max_megabytes times longer per megabyte for the largest input
+        if max(seconds_per_megabyte) > 3 * max(min(seconds_per_megabyte), 0.001):
+            is_linear = False
+    
+    print
+    # the old expression needs minutes for 64 KB of blank lines
+    print 'old regular expression (8 KB and 16 KB only):'
+    for name, generate in inputs:
+        for kilobytes in (8, 16):
+            markup = generate(kilobytes * 1024)
+            seconds = duration(parse_with_old_regex, markup, repetitions=1)
+            print '%-22s %6d KB %12.4f' % (name, kilobytes, seconds)
+    
+    print
+    print is_linear and 'parse_post() is linear' or 'parse_post() is NOT linear'
+    return is_linear
+
+
+if __name__ == '__main__':
+    max_megabytes = 8
+    if len(sys.argv) > 1:
+        max_megabytes = int(sys.argv[1])
+    sys.exit(not run(max_megabytes))
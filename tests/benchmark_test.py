@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import unittest
+
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from benchmarks.blog import benchmark_archive
+from benchmarks.environment import blog_environment
+from trac_wiki_blog.index import BlogPostIndex
+
+
+class BenchmarkTest(unittest.TestCase):
+    
+    def test_can_generate_blog_archive(self):
+        env = blog_environment(5)
+        assert_length(5, BlogPostIndex(env).post_names())
+    
+    def test_reports_timings_and_queries(self):
+        results = benchmark_archive(3, repetitions=1)
+        assert_equals(set(['load_pages_with_tags', 'sort_by_creation_date', 
+                           'expand_macro_cold', 'expand_macro_warm', 
+                           'new_post_form', 'new_post_save']), set(results))
+        assert_true(results['expand_macro_cold']['queries_per_call'] > 0)
+
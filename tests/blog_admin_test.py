@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from StringIO import StringIO
+import sys
+import unittest
+
+from trac.admin import AdminCommandError, AdminCommandManager
+from trac.wiki.model import WikiPage
+from trac_dev_platform.test.lib.pythonic_testcase import *
+from tractags.api import TagSystem
+
+from trac_wiki_blog.admin import RenderRequest
+from trac_wiki_blog.cache import RenderCache
+from trac_wiki_blog.index import BlogPostIndex
+
+from post_finder_test import BlogFixture
+
+
+class BlogAdminCommandsTest(BlogFixture, unittest.TestCase):
+    
+    def setUp(self):
+        super(BlogAdminCommandsTest, self).setUp()
+        self._create_post('Foo')
+        self._create_post('Bar')
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        super(BlogAdminCommandsTest, self).tearDown()
+    
+    def _create_post(self, name):
+        self._create_tagged_page(name)
+    
+    def _execute(self, *args):
+        return AdminCommandManager(self.env).execute_command(*args)
+    
+    def _delete_index(self):
+        cursor = self.env.get_db_cnx().cursor()
+        cursor.execute("DELETE FROM blog_post")
+    
+    def test_can_rebuild_index(self):
+        self._delete_index()
+        self._execute('blog', 'rebuild-index')
+        assert_equals(set(['Foo', 'Bar']), set(BlogPostIndex(self.env).post_names()))
+    
+    def test_can_warm_render_cache(self):
+        cache = RenderCache(self.env)
+        settings = cache.settings_key(RenderRequest(self.env))
+        assert_none(cache.get('Foo', 1, 'body', settings))
+        
+        self._execute('blog', 'warm-cache')
+        assert_contains('content', cache.get('Foo', 1, 'body', settings))
+        assert_not_none(cache.get('Bar', 1, 'title', settings))
+    
+    def test_rejects_invalid_number_of_workers(self):
+        assert_raises(AdminCommandError, lambda: self._execute('blog', 'warm-cache', '0'))
+    
+    def test_verify_succeeds_if_index_is_up_to_date(self):
+        self._execute('blog', 'verify')
+    
+    def test_verify_detects_outdated_index(self):
+        self._delete_index()
+        assert_raises(AdminCommandError, lambda: self._execute('blog', 'verify'))
+    
+    def test_verify_succeeds_after_running_the_suggested_commands(self):
+        self._execute('blog', 'warm-cache')
+        TagSystem(self.env).delete_tags(self.req(), WikiPage(self.env, 'Foo').resource)
+        cache = RenderCache(self.env)
+        cache.set('Bar', 0, 'body', cache.settings_key(RenderRequest(self.env)), 'old')
+        assert_raises(AdminCommandError, lambda: self._execute('blog', 'verify'))
+        
+        self._execute('blog', 'rebuild-index')
+        self._execute('blog', 'warm-cache')
+        self._execute('blog', 'verify')
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import unittest
+
+from BeautifulSoup import BeautifulSoup
+from trac.test import Mock
+from trac.util.datefmt import utc
+from trac.wiki.model import WikiPage
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.macro import ArchiveListMacro
+
+from post_finder_test import BlogFixture
+
+
+class BlogArchiveTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        super(BlogArchiveTest, self).setUp()
+        self.index = BlogPostIndex(self.env)
+    
+    def _create_post(self, name, year, month, day=1):
+        self._create_tagged_page(name, '= %s =\ncontent' % name, 
+                                 when=datetime.datetime(year, month, day, tzinfo=utc))
+    
+    def _post_titles(self, path):
+        response = self.simulate_request(self.get_request(path))
+        assert_equals(200, response.code())
+        soup = BeautifulSoup(response.html())
+        post_list = soup.find(name='ul', attrs={'class': 'blog_archive_posts'})
+        if post_list is None:
+            return []
+        return [link.string for link in post_list.findAll('a')]
+    
+    def test_counts_posts_per_month(self):
+        self._create_post('Foo', 2011, 5, 3)
+        self._create_post('Bar', 2011, 5, 20)
+        self._create_post('Baz', 2010, 12, 31)
+        
+        assert_equals([(2011, 5, 2), (2010, 12, 1)], self.index.archive())
+    
+    def test_removes_months_without_posts(self):
+        self._create_post('Foo', 2011, 5)
+        self._create_post('Bar', 2011, 4)
+        WikiPage(self.env, 'Foo').delete()
+        
+        assert_equals([(2011, 4, 1)], self.index.archive())
+    
+    def test_can_rebuild_archive(self):
+        self._create_post('Foo', 2011, 5)
+        self._create_post('Bar', 2009, 1)
+        cursor = self.env.get_db_cnx().cursor()
+        cursor.execute("DELETE FROM blog_archive")
+        assert_false(self.index.archive_is_up_to_date())
+        
+        self.index.rebuild_archive()
+        assert_equals([(2011, 5, 1), (2009, 1, 1)], self.index.archive())
+        assert_true(self.index.archive_is_up_to_date())
+    
+    def test_month_view_shows_only_posts_of_that_month(self):
+        self._create_post('Foo', 2011, 5, 31)
+        self._create_post('Bar', 2011, 6, 1)
+        self._create_post('Baz', 2011, 5, 1)
+        
+        assert_equals(['Foo', 'Baz'], self._post_titles('/blog/archive/2011/05'))
+        assert_equals([], self._post_titles('/blog/archive/2011/07'))
+    
+    def test_year_view_shows_posts_and_months(self):
+        self._create_post('Foo', 2011, 5)
+        self._create_post('Bar', 2011, 1)
+        self._create_post('Baz', 2010, 12)
+        
+        assert_equals(['Foo', 'Bar'], self._post_titles('/blog/archive/2011'))
+        response = self.simulate_request(self.get_request('/blog/archive/2011'))
+        soup = BeautifulSoup(response.html())
+        months = soup.find(name='ul', attrs={'class': 'blog_archive_months'})
+        assert_equals(['/blog/archive/2011/05', '/blog/archive/2011/01'], 
+                      [link['href'] for link in months.findAll('a')])
+    
+    def test_rejects_invalid_dates(self):
+        for path in ('/blog/archive/0000', '/blog/archive/9999/12', '/blog/archive/2011/13'):
+            response = self.simulate_request(self.get_request(path))
+            assert_equals(404, response.code())
+    
+    def test_archive_list_macro_links_to_months(self):
+        self._create_post('Foo', 2011, 5)
+        self._create_post('Bar', 2011, 5)
+        self._create_post('Baz', 2010, 12)
+        
+        html = ArchiveListMacro(self.env).expand_macro(Mock(req=self.req()), 'ArchiveList', '')
+        items = BeautifulSoup(unicode(html)).findAll('li')
+        assert_equals(['/blog/archive/2011/05', '/blog/archive/2010/12'], 
+                      [item.a['href'] for item in items])
+        assert_equals(['May 2011 (2)', 'December 2010 (1)'], 
+                      [''.join(item.findAll(text=True)) for item in items])
+
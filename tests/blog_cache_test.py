@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import unittest
+
+from trac_dev_platform.test import EnvironmentStub
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.cache import BlogCache, DatabaseCacheBackend, \
+    FileSystemCacheBackend, MemoryCacheBackend
+
+from post_finder_test import BlogFixture
+
+
+class BlogCacheTest(BlogFixture, unittest.TestCase):
+    
+    def setUp(self):
+        super(BlogCacheTest, self).setUp()
+        self.cache = BlogCache(self.env)
+    
+    def test_new_environments_start_with_first_generation(self):
+        assert_equals(0, self.cache.generation())
+    
+    def test_changed_pages_start_new_generation(self):
+        page = self._create_tagged_page('Foo')
+        generation = self.cache.generation()
+        assert_true(generation > 0)
+        
+        page.text = 'changed'
+        page.save(None, None, '127.0.0.1')
+        assert_equals(generation + 1, self.cache.generation())
+    
+    def test_returns_only_values_of_given_generation(self):
+        self.cache.set(('ShowPosts', 'foo'), 0, u'<p>foo</p>', 60)
+        assert_equals(u'<p>foo</p>', self.cache.get(('ShowPosts', 'foo'), 0))
+        assert_none(self.cache.get(('ShowPosts', 'bar'), 0))
+        
+        self.cache.invalidate()
+        assert_equals(1, self.cache.generation())
+        assert_none(self.cache.get(('ShowPosts', 'foo'), 1))
+    
+    def test_creates_generation_if_missing(self):
+        db = self.env.get_db_cnx()
+        db.cursor().execute("DELETE FROM system WHERE name=%s", (self.cache.generation_key,))
+        db.commit()
+        
+        self.cache.invalidate()
+        assert_equals(1, self.cache.generation())
+
+
+class CacheBackendTest(object):
+    
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True, enable=('trac_wiki_blog.*', 'tractags.*', 'trac.*'))
+        self.env.use_temp_directory()
+        self.env.upgrade()
+        self.backend = self.backend_class(self.env)
+    
+    def tearDown(self):
+        self.env.destroy_temp_directory()
+    
+    def test_can_store_values(self):
+        assert_none(self.backend.get('abc', 1))
+        self.backend.set('abc', 1, u'<p>caf\xe9</p>', 60)
+        
+        assert_equals(u'<p>caf\xe9</p>', self.backend.get('abc', 1))
+        assert_none(self.backend.get('abc', 2))
+    
+    def test_can_replace_values(self):
+        self.backend.set('abc', 1, u'old', 60)
+        self.backend.set('abc', 1, u'new', 60)
+        
+        assert_equals(u'new', self.backend.get('abc', 1))
+    
+    def test_does_not_return_expired_values(self):
+        self.backend.set('abc', 1, u'<p>foo</p>', -1)
+        assert_none(self.backend.get('abc', 1))
+    
+    def test_can_discard_old_generations(self):
+        self.backend.set('abc', 1, u'old', 60)
+        self.backend.set('abc', 2, u'new', 60)
+        self.backend.discard_generations_before(2)
+        
+        assert_none(self.backend.get('abc', 1))
+    
+    def test_cache_uses_configured_backend(self):
+        self.env.config.set('wiki-blog', 'cache_backend', self.backend_class.__name__)
+        cache = BlogCache(self.env)
+        cache.set('key', 0, u'value', 60)
+        
+        assert_equals(u'value', self.backend.get(cache._digest('key'), 0))
+
+
+class MemoryCacheBackendTest(CacheBackendTest, unittest.TestCase):
+    backend_class = MemoryCacheBackend
+
+
+class DatabaseCacheBackendTest(CacheBackendTest, unittest.TestCase):
+    backend_class = DatabaseCacheBackend
+
+
+class FileSystemCacheBackendTest(CacheBackendTest, unittest.TestCase):
+    backend_class = FileSystemCacheBackend
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import unittest
+
+from BeautifulSoup import BeautifulStoneSoup
+from trac.core import Component, implements
+from trac.perm import IPermissionPolicy, PermissionCache
+from trac.test import Mock
+from trac.util.datefmt import http_date, utc
+from trac.web.api import RequestDone
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.cache import BlogCache, RenderCache
+from trac_wiki_blog.util import send_not_modified_if_unchanged
+
+from post_finder_test import BlogFixture
+
+
+class HiddenFromBobPolicy(Component):
+    """Hides all pages with 'Secret' in their name from the user bob."""
+    
+    implements(IPermissionPolicy)
+    
+    def check_permission(self, action, username, resource, perm):
+        if username != 'bob' or not resource or resource.realm != 'wiki':
+            return None
+        if 'Secret' in (resource.id or ''):
+            return False
+        return None
+
+
+class BlogFeedTest(BlogFixture, TracTest):
+    
+    extra_components = (HiddenFromBobPolicy,)
+    
+    def _create_post(self, name, text):
+        self._create_tagged_page(name, text)
+    
+    def _request_feed(self, username=None, **headers):
+        self._headers = headers
+        req = self.get_request('/blog/feed')
+        if username is not None:
+            req.authname = username
+            req.perm = PermissionCache(self.env, username)
+        return self.simulate_request(req)
+    
+    def _get_feed(self, username=None):
+        response = self._request_feed(username)
+        assert_equals(200, response.code())
+        return BeautifulStoneSoup(response.html(), selfClosingTags=['link'])
+    
+    def test_contains_blog_posts(self):
+        self._create_post('Foo', "= Some Title =\nsome ''content''")
+        
+        feed = self._get_feed()
+        entries = feed.findAll('entry')
+        assert_length(1, entries)
+        assert_equals('Some Title', entries[0].find('title').string)
+        assert_equals('http://localhost/wiki/Foo', entries[0].find('id').string)
+        assert_contains('content', entries[0].find('content').string)
+    
+    def test_does_not_share_feed_between_users_with_fine_grained_permissions(self):
+        self._create_post('SecretPost', "= Secret =\nSecret body")
+        self.env.config.set('trac', 'permission_policies', 
+                            'HiddenFromBobPolicy, DefaultPermissionPolicy')
+        
+        alice_response = self._request_feed('alice')
+        assert_contains('Secret body', alice_response.html())
+        bob_response = self._request_feed('bob')
+        assert_false('Secret body' in bob_response.html())
+        assert_not_equals(alice_response.header('ETag'), bob_response.header('ETag'))
+    
+    def test_does_not_share_feed_between_hosts(self):
+        self._create_post('Foo', "= Title =\ncontent")
+        intranet_response = self._request_feed(Host='intranet.example')
+        assert_contains('http://intranet.example/wiki/Foo', intranet_response.html())
+        
+        public_response = self._request_feed(Host='public.example')
+        assert_false('intranet.example' in public_response.html())
+        assert_contains('http://public.example/wiki/Foo', public_response.html())
+        etag = intranet_response.header('ETag')
+        assert_equals(200, self._request_feed(**{'Host': 'public.example', 'If-None-Match': etag}).code())
+    
+    def test_renders_feed_again_when_blog_cache_is_invalidated(self):
+        self._create_post('Foo', "= Title =\nold content")
+        self._get_feed()
+        # no change listeners are notified, e.g. because another Trac process
+        # changed the page
+        db = self.env.get_db_cnx()
+        db.cursor().execute("UPDATE wiki SET text=%s WHERE name=%s", 
+                            ("= Title =\nnew content", 'Foo'))
+        db.commit()
+        RenderCache(self.env).clear()
+        assert_contains('old content', self._get_feed().find('content').string)
+        
+        BlogCache(self.env).invalidate()
+        assert_contains('new content', self._get_feed().find('content').string)
+    
+    def test_uses_page_name_as_title_of_posts_without_heading(self):
+        self._create_post('Foo', "just ''content''")
+        
+        entries = self._get_feed().findAll('entry')
+        assert_equals('Foo', entries[0].find('title').string)
+        assert_contains('content', entries[0].find('content').string)
+    
+    def test_contains_only_posts_the_user_may_see(self):
+        self._create_post('Foo', "= Some Title =\ncontent")
+        self.revoke_permission('anonymous', 'TRAC_ADMIN')
+        self.revoke_permission('anonymous', 'WIKI_VIEW')
+        self.assert_has_permission('anonymous', 'TAGS_VIEW')
+        
+        feed = self._get_feed()
+        assert_length(0, feed.findAll('entry'))
+
+
+class ConditionalGetTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.last_modified = datetime.datetime(2011, 1, 1, tzinfo=utc)
+        self.response = dict(headers={}, status=None)
+    
+    def _request(self, **request_headers):
+        def send_header(name, value):
+            self.response['headers'][name] = value
+        def send_response(code):
+            self.response['status'] = code
+        return Mock(get_header=request_headers.get, send_header=send_header, 
+                    send_response=send_response, end_headers=lambda: None)
+    
+    def _check(self, req):
+        try:
+            send_not_modified_if_unchanged(req, 'abc', self.last_modified)
+        except RequestDone:
+            return True
+        return False
+    
+    def test_adds_validators_to_response(self):
+        assert_false(self._check(self._request()))
+        assert_equals('"abc"', self.response['headers']['ETag'])
+        assert_equals(http_date(self.last_modified), self.response['headers']['Last-Modified'])
+    
+    def test_sends_not_modified_for_matching_etag(self):
+        assert_true(self._check(self._request(**{'If-None-Match': '"abc"'})))
+        assert_equals(304, self.response['status'])
+    
+    def test_ignores_other_etags(self):
+        assert_false(self._check(self._request(**{'If-None-Match': '"def"'})))
+    
+    def test_sends_not_modified_if_unchanged_since_given_date(self):
+        headers = {'If-Modified-Since': http_date(self.last_modified)}
+        assert_true(self._check(self._request(**headers)))
+        
+        earlier = http_date(self.last_modified - datetime.timedelta(seconds=1))
+        assert_false(self._check(self._request(**{'If-Modified-Since': earlier})))
+
@@ -22,12 +22,20 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import datetime
 import unittest
 
-from trac.perm import PermissionSystem
+from trac.core import Component, implements
+from trac.perm import IPermissionPolicy, PermissionSystem
+from trac.util.datefmt import utc
 from trac_dev_platform.test import EnvironmentStub, TracTest
 from trac_dev_platform.test.lib.pythonic_testcase import *
 
+from trac_wiki_blog.cache import RenderCache
+from trac_wiki_blog.index import BlogPostIndex
+
+from post_finder_test import BlogFixture
+
 
 class BlogPermissionsTest(TracTest):
 
@@ -40,3 +48,64 @@ class BlogPermissionsTest(TracTest):
         assert_length(len(set(all_known_actions)), all_known_actions)
 
 
+
+
+class SecretPostsPolicy(Component):
+    """Hides all blog posts with 'Secret' in their name."""
+    
+    implements(IPermissionPolicy)
+    
+    def check_permission(self, action, username, resource, perm):
+        if resource and resource.realm == 'wiki' and 'Secret' in (resource.id or ''):
+            return False
+        return None
+
+
+class BlogPostVisibilityTest(BlogFixture, TracTest):
+    
+    extra_components = (SecretPostsPolicy,)
+    
+    def setUp(self):
+        super(BlogPostVisibilityTest, self).setUp()
+        self.index = BlogPostIndex(self.env)
+        self._create_post('Public', datetime.datetime(2011, 5, 1, tzinfo=utc))
+        self._create_post('SecretPost', datetime.datetime(2011, 5, 2, tzinfo=utc))
+        self._create_post('OtherSecret', datetime.datetime(2011, 4, 1, tzinfo=utc))
+    
+    def _create_post(self, name, when):
+        self._create_tagged_page(name, when=when)
+    
+    def _use_secret_posts_policy(self):
+        self.env.config.set('trac', 'permission_policies', 
+                            'SecretPostsPolicy, DefaultPermissionPolicy')
+    
+    def test_shows_all_posts_with_default_policies(self):
+        assert_equals(['SecretPost', 'Public', 'OtherSecret'], 
+                      self.index.visible_post_names(self.req()))
+        assert_equals([(2011, 5, 2), (2011, 4, 1)], self.index.visible_archive(self.req()))
+    
+    def test_hides_posts_denied_by_fine_grained_permissions(self):
+        self._use_secret_posts_policy()
+        assert_equals(['Public'], self.index.visible_post_names(self.req()))
+    
+    def test_counts_only_visible_posts_in_archive(self):
+        self._use_secret_posts_policy()
+        assert_equals([(2011, 5, 1)], self.index.visible_archive(self.req()))
+    
+    def _settings_key(self, username):
+        req = self.req()
+        req.authname = username
+        return RenderCache(self.env).settings_key(req)
+    
+    def test_render_cache_is_shared_by_users_with_same_permissions(self):
+        assert_equals(self._settings_key('alice'), self._settings_key('bob'))
+    
+    def test_render_cache_is_per_user_with_fine_grained_permissions(self):
+        self._use_secret_posts_policy()
+        assert_not_equals(self._settings_key('alice'), self._settings_key('bob'))
+    
+    def test_shows_no_posts_without_wiki_view(self):
+        self.revoke_permission('anonymous', 'TRAC_ADMIN')
+        self.revoke_permission('anonymous', 'WIKI_VIEW')
+        assert_equals([], self.index.visible_post_names(self.req()))
+        assert_equals([], self.index.visible_archive(self.req()))
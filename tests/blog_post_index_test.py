@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import unittest
+
+from trac.perm import PermissionSystem
+from trac.util.datefmt import utc
+from trac.wiki.model import WikiPage
+from trac_dev_platform.test import EnvironmentStub, mock_request, TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+from tractags.query import InvalidQuery
+
+from trac_wiki_blog.db import BlogEnvironmentSetup
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.related import RelatedPostsIndex
+
+from post_finder_test import BlogFixture, create_tagged_page
+
+
+class BlogPostIndexTest(BlogFixture, unittest.TestCase):
+    
+    def setUp(self):
+        super(BlogPostIndexTest, self).setUp()
+        self.index = BlogPostIndex(self.env)
+    
+    def _create_page(self, name, text, tags=('blog',), when=None):
+        return self._create_tagged_page(name, text, tags, when)
+    
+    def _post(self, name):
+        posts = self.index.get_posts([name])
+        if len(posts) == 0:
+            return None
+        return posts[0]
+    
+    def test_indexes_new_blog_posts(self):
+        long_ago = datetime.datetime(year=2000, month=1, day=1, tzinfo=utc)
+        self._create_page('Foo', '= Some Title =\ncontent', when=long_ago)
+        
+        post = self._post('Foo')
+        assert_equals('Some Title', post.title)
+        assert_equals(long_ago, post.created)
+        assert_equals('author', post.author)
+        assert_equals(['blog'], post.tags)
+        assert_equals(1, post.version)
+    
+    def test_ignores_pages_without_blog_tag(self):
+        self._create_page('Foo', '= Title =\ncontent', tags=('fnord',))
+        assert_none(self._post('Foo'))
+    
+    def test_updates_changed_posts(self):
+        long_ago = datetime.datetime(year=2000, month=1, day=1, tzinfo=utc)
+        page = self._create_page('Foo', '= Title =\ncontent', when=long_ago)
+        page.text = '= New Title =\ncontent'
+        page.save('editor', 'comment', '127.0.0.1')
+        
+        post = self._post('Foo')
+        assert_equals('New Title', post.title)
+        assert_equals(2, post.version)
+        assert_equals(long_ago, post.created)
+        assert_not_equals(long_ago, post.modified)
+        assert_equals('author', post.author)
+    
+    def test_removes_deleted_posts(self):
+        page = self._create_page('Foo', '= Title =\ncontent')
+        page.delete()
+        assert_none(self._post('Foo'))
+    
+    def test_returns_newest_posts_first(self):
+        long_ago = datetime.datetime(year=2000, month=1, day=1, tzinfo=utc)
+        self._create_page('Old', '= Title =\ncontent', when=long_ago)
+        self._create_page('New', '= Title =\ncontent')
+        assert_equals(['New', 'Old'], self.index.post_names())
+    
+    def test_can_rebuild_index(self):
+        self._create_page('Foo', '= Title =\ncontent')
+        cursor = self.env.get_db_cnx().cursor()
+        cursor.execute("DELETE FROM blog_post")
+        assert_equals([], self.index.post_names())
+        
+        self.index.rebuild()
+        assert_equals(['Foo'], self.index.post_names())
+
+    
+    def test_can_filter_posts_by_tag_query(self):
+        self._create_page('Foo', '= Title =\ncontent', tags=('blog', 'release'))
+        self._create_page('Bar', '= Title =\ncontent', tags=('blog', 'release', 'draft'))
+        self._create_page('Baz', '= Title =\ncontent', tags=('blog', 'security'))
+        self._create_page('Qux', '= Title =\ncontent', tags=('release',))
+        
+        assert_equals(['Bar', 'Foo'], sorted(self.index.post_names(query='release')))
+        assert_equals(['Foo'], self.index.post_names(query='release -draft'))
+        assert_equals(['Baz', 'Foo'], sorted(self.index.post_names(
+                                          query='(release or security) -draft')))
+        assert_equals(['Bar'], self.index.post_names(query='realm:wiki draft'))
+    
+    def test_rejects_unsupported_query_attributes(self):
+        assert_raises(InvalidQuery, lambda: self.index.post_names(query='author:foo'))
+    
+    def test_loads_post_text_only_when_needed(self):
+        self._create_page('Foo', '= Title =\nfirst version')
+        post = self._post('Foo')
+        self._create_page('Foo', '= Title =\nsecond version')
+        
+        assert_none(post._text)
+        assert_equals('= Title =\nfirst version', post.text)
+        assert_false(hasattr(post, '__dict__'))
+
+
+class TagChangesInWikiEditorTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        super(TagChangesInWikiEditorTest, self).setUp()
+        self.index = BlogPostIndex(self.env)
+    
+    def _create_page(self, name, tags):
+        self._create_tagged_page(name, tags=tags)
+    
+    def _save(self, name, tags, text='= Title =\ncontent'):
+        version = WikiPage(self.env, name).version
+        req = self.post_request('/wiki/' + name, action='edit', save='Submit changes',
+                                text=text, tags=tags, version=version)
+        response = self.simulate_request(req)
+        assert_equals(303, response.code())
+    
+    def test_removes_post_when_only_the_blog_tag_is_removed(self):
+        self._create_page('Foo', ('blog', 'trac'))
+        self._save('Foo', 'trac')
+        
+        assert_equals([], self.index.post_names())
+        assert_equals([], self.index.tag_counts())
+    
+    def test_indexes_tags_changed_together_with_the_text(self):
+        self._create_page('Foo', ('blog', 'trac'))
+        self._create_page('Bar', ('blog', 'python'))
+        self._save('Bar', 'blog python trac', text='= Title =\nnew content')
+        
+        assert_equals([('python', 1), ('trac', 2)], self.index.tag_counts())
+        related = RelatedPostsIndex(self.env).related_posts(self.req(), 'Foo', 5)
+        assert_equals(['Bar'], [post.name for post in related])
+
+
+class EnvironmentSetupTest(unittest.TestCase):
+    
+    def setUp(self):
+        # like 'trac-admin initenv': TracTags creates its tables only during
+        # the first upgrade
+        self.env = EnvironmentStub(default_data=True, enable=('trac_wiki_blog.*', 'tractags.*', 'trac.*'))
+    
+    def tearDown(self):
+        self.env.destroy_temp_directory()
+    
+    def test_creates_tables_before_tractags_was_set_up(self):
+        BlogEnvironmentSetup(self.env).environment_created()
+        
+        assert_false(BlogEnvironmentSetup(self.env).environment_needs_upgrade(self.env.get_db_cnx()))
+        assert_equals([], BlogPostIndex(self.env).post_names())
+    
+    def test_upgrade_skips_rebuilding_the_index_without_tags_table(self):
+        BlogEnvironmentSetup(self.env).upgrade_environment(self.env.get_db_cnx())
+        
+        self.env.upgrade()
+        PermissionSystem(self.env).grant_permission('anonymous', 'TRAC_ADMIN')
+        req = mock_request('/')
+        req.populate(self.env)
+        page = create_tagged_page(self.env, req, 'Foo', '= Title =\ncontent', ('blog',))
+        page.save('author', 'comment', '127.0.0.1')
+        assert_equals(['Foo'], BlogPostIndex(self.env).post_names())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import unittest
+
+from BeautifulSoup import BeautifulSoup
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.search import BlogSearchIndex, tokenize
+
+from post_finder_test import BlogFixture
+
+
+class BlogSearchTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        super(BlogSearchTest, self).setUp()
+        self.search_index = BlogSearchIndex(self.env)
+    
+    def _create_post(self, name, title, content, tags=('blog',)):
+        return self._create_tagged_page(name, '= %s =\n%s' % (title, content), tags)
+    
+    def _search(self, *terms, **kwargs):
+        posts = self.search_index.search(self.req(), terms, **kwargs)
+        return [post.name for post in posts]
+    
+    def test_splits_text_into_lowercase_words(self):
+        assert_equals([u'release', u'notes', u'for', u'0_12', u'caf\xe9'], 
+                      tokenize(u'Release-Notes for 0_12 (a) Caf\xe9!'))
+    
+    def test_finds_posts_containing_all_terms(self):
+        self._create_post('Foo', 'Release', 'new features and bug fixes')
+        self._create_post('Bar', 'Security', 'important bug fixes')
+        self._create_post('Baz', 'Other', 'features')
+        
+        assert_equals(['Bar', 'Foo'], sorted(self._search('bug', 'FIXES')))
+        assert_equals(['Foo'], self._search('features bug'))
+        assert_equals([], self._search('unknown'))
+        assert_equals([], self._search('!'))
+    
+    def test_ranks_matches_in_title_higher(self):
+        self._create_post('Foo', 'Something', 'release release')
+        self._create_post('Bar', 'Release', 'text')
+        self._create_post('Baz', 'Other', 'release')
+        
+        assert_equals(['Bar', 'Foo', 'Baz'], self._search('release'))
+        assert_equals(['Foo', 'Baz'], self._search('release', limit=2, offset=1))
+    
+    def test_ignores_pages_which_are_no_blog_posts(self):
+        self._create_post('Foo', 'Release', 'text', tags=('news',))
+        assert_equals([], self._search('release'))
+    
+    def test_updates_index_when_posts_change(self):
+        page = self._create_post('Foo', 'Release', 'old text')
+        page.text = '= Release =\nnew text'
+        page.save('author', None, '127.0.0.1')
+        assert_equals([], self._search('old'))
+        assert_equals(['Foo'], self._search('new'))
+        
+        page.delete()
+        assert_equals([], self._search('new'))
+    
+    def test_can_rebuild_index(self):
+        self._create_post('Foo', 'Release', 'text')
+        db = self.env.get_db_cnx()
+        db.cursor().execute("DELETE FROM blog_search")
+        db.commit()
+        assert_equals([], self._search('release'))
+        
+        self.search_index.rebuild()
+        assert_equals(['Foo'], self._search('release'))
+    
+    def test_hides_posts_without_permission(self):
+        self._create_post('Foo', 'Release', 'text')
+        self.revoke_permission('anonymous', 'TRAC_ADMIN')
+        self.revoke_permission('anonymous', 'TAGS_VIEW')
+        
+        assert_equals([], self._search('release'))
+    
+    def test_provides_blog_filter_for_search_page(self):
+        self._create_post('Foo', 'Release Notes', 'text')
+        self._create_post('Bar', 'Other', 'text')
+        
+        # necessary so the /search path works
+        import trac.search.web_ui
+        response = self.simulate_request(self.get_request('/search', q='release', blog='on'))
+        assert_equals(200, response.code())
+        results = BeautifulSoup(response.html()).find('dl', id='results')
+        assert_equals(['/wiki/Foo'], [link['href'] for link in results.findAll('a')])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import unittest
+
+from BeautifulSoup import BeautifulStoneSoup
+from trac.util.datefmt import utc
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.web_ui import BlogSitemapModule
+
+from post_finder_test import BlogFixture
+
+
+class BlogSitemapTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        super(BlogSitemapTest, self).setUp()
+        self.day = 0
+    
+    def _create_post(self, name):
+        self.day += 1
+        self._create_tagged_page(name, 'content', 
+                                 when=datetime.datetime(2011, 5, self.day, tzinfo=utc))
+    
+    def _get(self, path, **headers):
+        self._headers = headers
+        return self.simulate_request(self.get_request(path))
+    
+    def _get_sitemap(self, path='/blog/sitemap.xml'):
+        response = self._get(path)
+        assert_equals(200, response.code())
+        assert_equals(str(len(response.html())), response.header('Content-Length'))
+        return BeautifulStoneSoup(response.html())
+    
+    def test_lists_all_blog_posts(self):
+        self._create_post('Foo')
+        self._create_post('Bar')
+        
+        urls = self._get_sitemap().findAll('url')
+        assert_equals(['http://localhost/wiki/Foo', 'http://localhost/wiki/Bar'], 
+                      [url.find('loc').string for url in urls])
+        assert_equals('2011-05-01T00:00:00Z', urls[0].find('lastmod').string)
+    
+    def test_contains_only_posts_the_user_may_see(self):
+        self._create_post('Foo')
+        self.revoke_permission('anonymous', 'TRAC_ADMIN')
+        self.revoke_permission('anonymous', 'WIKI_VIEW')
+        
+        assert_length(0, self._get_sitemap().findAll('url'))
+    
+    def test_splits_big_sitemaps_into_sitemap_index(self):
+        BlogSitemapModule(self.env).max_urls = 2
+        for name in ('Foo', 'Bar', 'Baz'):
+            self._create_post(name)
+        
+        sitemaps = self._get_sitemap().findAll('sitemap')
+        assert_equals(['http://localhost/blog/sitemap-1.xml', 'http://localhost/blog/sitemap-2.xml'], 
+                      [sitemap.find('loc').string for sitemap in sitemaps])
+        assert_equals('2011-05-03T00:00:00Z', sitemaps[0].find('lastmod').string)
+        
+        def urls(path):
+            return [url.find('loc').string for url in self._get_sitemap(path).findAll('url')]
+        assert_equals(['http://localhost/wiki/Foo', 'http://localhost/wiki/Bar'], urls('/blog/sitemap-1.xml'))
+        assert_equals(['http://localhost/wiki/Baz'], urls('/blog/sitemap-2.xml'))
+        assert_equals(404, self._get('/blog/sitemap-3.xml').code())
+    
+    def test_content_length_matches_body_if_posts_change_while_sending(self):
+        self._create_post('Foo')
+        index = BlogPostIndex(self.env)
+        original_iter_visible_posts = index.iter_visible_posts
+        def iter_visible_posts_then_add_post(*args):
+            for post in original_iter_visible_posts(*args):
+                yield post
+            if len(index.post_names()) == 1:
+                self._create_post('Bar')
+        index.iter_visible_posts = iter_visible_posts_then_add_post
+        try:
+            urls = self._get_sitemap().findAll('url')
+        finally:
+            del index.iter_visible_posts
+        assert_equals(['http://localhost/wiki/Foo'], [url.find('loc').string for url in urls])
+    
+    def test_spools_big_sitemaps_to_disk(self):
+        BlogSitemapModule(self.env).spool_size = 100
+        for name in ('Foo', 'Bar', 'Baz'):
+            self._create_post(name)
+        
+        urls = self._get_sitemap().findAll('url')
+        assert_equals(['http://localhost/wiki/Foo', 'http://localhost/wiki/Bar', 'http://localhost/wiki/Baz'], 
+                      [url.find('loc').string for url in urls])
+    
+    def test_sends_not_modified_if_no_post_changed(self):
+        self._create_post('Foo')
+        etag = self._get('/blog/sitemap.xml').header('ETag')
+        
+        assert_equals(304, self._get('/blog/sitemap.xml', **{'If-None-Match': etag}).code())
+        self._create_post('Bar')
+        assert_equals(200, self._get('/blog/sitemap.xml', **{'If-None-Match': etag}).code())
+    
+    def test_does_not_send_not_modified_for_other_hosts(self):
+        self._create_post('Foo')
+        etag = self._get('/blog/sitemap.xml', Host='intranet.example').header('ETag')
+        
+        response = self._get('/blog/sitemap.xml', **{'Host': 'public.example', 'If-None-Match': etag})
+        assert_equals(200, response.code())
+        assert_contains('http://public.example/wiki/Foo', response.html())
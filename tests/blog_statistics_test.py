@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import unittest
+
+from BeautifulSoup import BeautifulSoup
+from trac.test import Mock
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.macro import ShowPostsMacro
+from trac_wiki_blog.stats import BlogStatistics, CountingConnection, \
+    get_db_cnx, null_recorder
+
+from post_finder_test import BlogFixture
+
+
+class BlogStatisticsTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        # necessary so the /admin path (and its templates) work
+        import trac.admin.web_ui
+        super(BlogStatisticsTest, self).setUp()
+        self.env.config.set('wiki-blog', 'statistics', 'true')
+        self.statistics = BlogStatistics(self.env)
+    
+    def _create_post(self, name):
+        self._create_tagged_page(name, '= %s =\ncontent' % name)
+    
+    def _expand_macro(self):
+        return ShowPostsMacro(self.env).expand_macro(Mock(req=self.req()), 'ShowPosts', '')
+    
+    def _phases(self):
+        return dict([(entry['phase'], entry) for entry in self.statistics.totals()
+                     if entry['name'] == 'ShowPosts'])
+    
+    def test_records_phases_of_show_posts_macro(self):
+        self._create_post('Foo')
+        self._create_post('Bar')
+        self._expand_macro()
+        
+        phases = self._phases()
+        assert_equals(1, phases['post_names']['calls'])
+        assert_true(phases['post_names']['queries'] > 0)
+        assert_equals(1, phases['get_posts']['calls'])
+        assert_equals(2, phases['wiki_to_html']['calls'])
+        assert_equals(2, phases['title_to_html']['calls'])
+        assert_equals(1, phases['render_template']['measurements'])
+        # posts are formatted while the template is serialized
+        assert_true(phases['render_template']['seconds'] >= 
+                    phases['wiki_to_html']['seconds'] + phases['title_to_html']['seconds'])
+    
+    def test_sums_up_several_macro_calls(self):
+        self.env.config.set('wiki-blog', 'output_cache', 'false')
+        self._create_post('Foo')
+        self._expand_macro()
+        self._expand_macro()
+        
+        phases = self._phases()
+        assert_equals(2, phases['post_names']['calls'])
+        assert_equals(2, phases['post_names']['measurements'])
+        # the second call takes the html from the render cache
+        assert_equals(1, phases['wiki_to_html']['calls'])
+        assert_equals(4, phases['render_cache']['calls'])
+    
+    def test_counts_queries_only_while_measuring(self):
+        self._create_post('Foo')
+        env_attributes = set(self.env.__dict__)
+        self._expand_macro()
+        assert_true(self._phases()['get_posts']['queries'] > 0)
+        
+        def query():
+            get_db_cnx(self.env).cursor().execute("SELECT name FROM blog_post")
+        recorder = self.statistics.recorder(self.req(), 'Query')
+        recorder.measure('query', query)
+        recorder.finish()
+        assert_equals(1, self.statistics.totals()[0]['queries'])
+        assert_equals('Query', self.statistics.totals()[0]['name'])
+        assert_false(isinstance(get_db_cnx(self.env), CountingConnection))
+        assert_equals(env_attributes, set(self.env.__dict__))
+    
+    def test_does_not_record_anything_if_disabled(self):
+        self.env.config.set('wiki-blog', 'statistics', 'false')
+        self.env.log.setLevel('DEBUG')
+        self._create_post('Foo')
+        
+        assert_equals(null_recorder, self.statistics.recorder(self.req(), 'ShowPosts'))
+        self._expand_macro()
+        assert_equals([], self.statistics.totals())
+    
+    def test_admin_panel_lists_statistics(self):
+        self._create_post('Foo')
+        self._expand_macro()
+        
+        response = self.simulate_request(self.get_request('/admin/blog/stats'))
+        assert_equals(200, response.code())
+        table = BeautifulSoup(response.html()).find('table', id='blog_statistics')
+        assert_not_none(table)
+        assert_true('post_names' in table.text)
+    
+    def test_can_reset_statistics(self):
+        self._create_post('Foo')
+        self._expand_macro()
+        
+        self.simulate_request(self.post_request('/admin/blog/stats', reset='1'))
+        assert_equals([], self.statistics.totals())
+
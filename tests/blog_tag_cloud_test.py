@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import datetime
+import unittest
+
+from BeautifulSoup import BeautifulSoup
+from trac.test import Mock
+from trac.util.datefmt import utc
+from tractags.api import TagSystem
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.macro import BlogTagCloudMacro
+
+from post_finder_test import BlogFixture
+
+
+class BlogTagCloudTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        super(BlogTagCloudTest, self).setUp()
+        self.index = BlogPostIndex(self.env)
+        self.day = 0
+    
+    def _create_page(self, name, *tags):
+        self.day += 1
+        return self._create_tagged_page(name, '= %s =\ncontent' % name, tags, 
+                                        when=datetime.datetime(2011, 5, self.day, tzinfo=utc))
+    
+    def _create_post(self, name, *tags):
+        return self._create_page(name, 'blog', *tags)
+    
+    def test_counts_tags_of_blog_posts_only(self):
+        self._create_post('Foo', 'trac', 'python')
+        self._create_post('Bar', 'trac')
+        self._create_page('Other', 'trac', 'cooking')
+        
+        assert_equals([('python', 1), ('trac', 2)], self.index.tag_counts())
+    
+    def test_updates_counts_when_tags_change(self):
+        self._create_post('Foo', 'trac')
+        page = self._create_post('Bar', 'python')
+        
+        TagSystem(self.env).add_tags(self.req(), page.resource, ['trac'])
+        page.text = 'changed'
+        page.save('author', None, '127.0.0.1')
+        assert_equals([('python', 1), ('trac', 2)], self.index.tag_counts())
+        
+        page.delete()
+        assert_equals([('trac', 1)], self.index.tag_counts())
+    
+    def test_can_rebuild_counts(self):
+        self._create_post('Foo', 'trac')
+        db = self.env.get_db_cnx()
+        db.cursor().execute("DELETE FROM blog_tag")
+        db.commit()
+        
+        self.index.rebuild_tag_counts()
+        assert_equals([('trac', 1)], self.index.tag_counts())
+    
+    def _expand_macro(self, argument_string=''):
+        formatter = Mock(req=self.req())
+        return unicode(BlogTagCloudMacro(self.env).expand_macro(formatter, 'BlogTagCloud', argument_string))
+    
+    def test_macro_links_to_tags_with_font_size_by_usage(self):
+        self._create_post('Foo', 'trac', 'python')
+        self._create_post('Bar', 'trac')
+        
+        links = BeautifulSoup(self._expand_macro()).findAll('a')
+        assert_equals(['python', 'trac'], [link.string for link in links])
+        assert_equals(['/tags/python', '/tags/trac'], [link['href'] for link in links])
+        assert_equals(['font-size: 100%', 'font-size: 200%'], [link['style'] for link in links])
+        assert_equals(['1 post', '2 posts'], [link['title'] for link in links])
+    
+    def test_macro_can_show_only_most_used_tags(self):
+        self._create_post('Foo', 'trac', 'python')
+        self._create_post('Bar', 'trac', 'release')
+        self._create_post('Baz', 'release')
+        
+        links = BeautifulSoup(self._expand_macro('2')).findAll('a')
+        assert_equals(['release', 'trac'], [link.string for link in links])
+    
+    def test_macro_shows_nothing_without_tagged_posts(self):
+        self._create_post('Foo')
+        assert_equals('', self._expand_macro())
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from StringIO import StringIO
+import unittest
+
+from trac.mimeview.api import Context
+from trac.perm import PermissionCache
+from trac.resource import Resource
+from trac.test import Mock
+from trac.util.datefmt import utc
+from trac.web.api import Request, RequestDone
+from trac.web.chrome import Chrome
+from trac.web.session import DetachedSession
+from trac.wiki.formatter import format_to_html
+from trac.wiki.model import WikiPage
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.macro import ShowPostsConditionalGet
+
+from post_finder_test import BlogFixture
+
+
+class ShowPostsConditionalGetTest(BlogFixture, unittest.TestCase):
+    
+    def setUp(self):
+        super(ShowPostsConditionalGetTest, self).setUp()
+        self.env.config.set('wiki-blog', 'conditional_get', 'true')
+        self.component = ShowPostsConditionalGet(self.env)
+        self.status = None
+        self.headers = {}
+        
+        self.page = WikiPage(self.env, 'Blog')
+        self.page.text = '[[ShowPosts]]'
+        self.page.save(None, None, '127.0.0.1')
+        self._create_post('Foo')
+    
+    def _create_post(self, name):
+        self._create_tagged_page(name)
+    
+    def _start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = dict(headers)
+        return lambda data: None
+    
+    def _request(self, path='/wiki/Blog', **headers):
+        environ = {'REQUEST_METHOD': 'GET', 'SERVER_NAME': 'localhost', 
+                   'SERVER_PORT': '80', 'SCRIPT_NAME': '', 'PATH_INFO': path,
+                   'QUERY_STRING': '', 'wsgi.url_scheme': 'http', 
+                   'wsgi.input': StringIO()}
+        for name, value in headers.items():
+            environ['HTTP_' + name.upper()] = value
+        req = Request(environ, self._start_response)
+        req.callbacks.update({
+            'authname': lambda req: 'anonymous',
+            'chrome': Chrome(self.env).prepare_request,
+            'perm': lambda req: PermissionCache(self.env, 'anonymous'),
+            'locale': lambda req: None,
+            'session': lambda req: DetachedSession(self.env, 'anonymous'),
+            'tz': lambda req: utc,
+        })
+        return req
+    
+    def _view_page(self):
+        req = self._request()
+        try:
+            self.component.pre_process_request(req, None)
+        except RequestDone:
+            return
+        formatter = Mock(req=req, context=Mock(resource=Resource('wiki', 'Blog')))
+        self.component.register(formatter)
+        try:
+            req.send('content')
+        except RequestDone:
+            pass
+    
+    def _revalidate(self, etag):
+        req = self._request(if_none_match=etag)
+        try:
+            self.component.pre_process_request(req, None)
+        except RequestDone:
+            return self.status
+        return None
+    
+    def test_adds_validators_to_pages_with_posts(self):
+        self._view_page()
+        assert_equals('200 Ok', self.status)
+        assert_true('ETag' in self.headers)
+        assert_true('Last-Modified' in self.headers)
+    
+    def test_sends_not_modified_if_nothing_changed(self):
+        self._view_page()
+        assert_equals('304 Not Modified', self._revalidate(self.headers['ETag']))
+    
+    def test_changed_posts_invalidate_etag(self):
+        self._view_page()
+        etag = self.headers['ETag']
+        self._create_post('Bar')
+        assert_none(self._revalidate(etag))
+    
+    def test_changed_page_invalidates_etag(self):
+        self._view_page()
+        etag = self.headers['ETag']
+        self.page.text = 'no more posts'
+        self.page.save(None, None, '127.0.0.1')
+        assert_none(self._revalidate(etag))
+    
+    def test_does_nothing_unless_enabled(self):
+        self.env.config.set('wiki-blog', 'conditional_get', 'false')
+        self._view_page()
+        assert_false('ETag' in self.headers)
+    
+    def test_revalidates_pages_registered_by_other_processes(self):
+        self._view_page()
+        etag = self.headers['ETag']
+        # a new component instance knows nothing about the first request
+        del self.env.components[ShowPostsConditionalGet]
+        self.component = ShowPostsConditionalGet(self.env)
+        
+        assert_equals('304 Not Modified', self._revalidate(etag))
+    
+    def test_rendering_the_macro_never_aborts_the_response(self):
+        self._view_page()
+        req = self._request(if_none_match=self.headers['ETag'])
+        self.status, self.headers = None, {}
+        
+        context = Context.from_request(req, Resource('wiki', 'Blog'))
+        html = unicode(format_to_html(self.env, context, self.page.text))
+        assert_false('failed' in html)
+        assert_contains('/wiki/Foo', html)
+        assert_none(self.status)
+        try:
+            req.send('content')
+        except RequestDone:
+            pass
+        assert_equals('200 Ok', self.status)
+        assert_true('ETag' in self.headers)
@@ -33,7 +33,8 @@ import unittest
 
 from trac_dev_platform.test.lib.pythonic_testcase import *
 
-from trac_wiki_blog.util import content_from_wiki_markup, title_from_wiki_markup
+from trac_wiki_blog.util import content_from_wiki_markup, \
+    excerpt_from_wiki_markup, parse_post, title_from_wiki_markup
 
 
 class ContentParser(unittest.TestCase):
@@ -68,5 +69,41 @@ class ContentParser(unittest.TestCase):
     def test_can_extract_multiline_content(self):
         assert_equals("bla\nblub", content_from_wiki_markup("= blub = bla\nblub"))
     
+    def test_can_parse_title_and_content_at_once(self):
+        assert_equals(("Title", "first line\nsecond line"), 
+                      parse_post("[[PageOutline]]\n== Title ==\n\nfirst line\nsecond line"))
+    
+    def test_title_must_end_on_the_same_line(self):
+        assert_equals(("real", "text"), parse_post("= no end\n= real =\ntext"))
+    
+    def test_can_handle_huge_pages_without_title(self):
+        assert_raises(ValueError, lambda: parse_post("\n" * 100000 + "x"))
+        assert_raises(ValueError, lambda: parse_post(("= " + " " * 1000 + "\n") * 100))
+    
+    # ================================================================
+    # Excerpts
+    
+    def test_excerpt_ends_before_more_marker(self):
+        assert_equals("teaser", excerpt_from_wiki_markup("teaser\n[[more]]\nrest", paragraphs=5))
+    
+    def test_excerpt_is_complete_text_without_limits(self):
+        assert_equals("foo\n\nbar", excerpt_from_wiki_markup("foo\n\nbar"))
+    
+    def test_can_limit_excerpt_to_paragraphs(self):
+        markup = "first\nstill first\n\n\nsecond\n\nthird"
+        assert_equals("first\nstill first", excerpt_from_wiki_markup(markup, paragraphs=1))
+        assert_equals("first\nstill first\n\n\nsecond", excerpt_from_wiki_markup(markup, paragraphs=2))
+    
+    def test_blank_lines_in_code_blocks_do_not_end_paragraphs(self):
+        markup = "{{{\nfoo\n\nbar\n}}}\n\nsecond"
+        assert_equals("{{{\nfoo\n\nbar\n}}}", excerpt_from_wiki_markup(markup, paragraphs=1))
+    
+    def test_can_limit_excerpt_to_characters(self):
+        assert_equals(u"some long \u2026", excerpt_from_wiki_markup("some long text", characters=12))
+    
+    def test_does_not_cut_code_blocks(self):
+        markup = "foo\n{{{\nsome code\n}}}"
+        assert_equals("foo", excerpt_from_wiki_markup(markup, characters=10))
+    
 # TODO: consider changing parsing to really "extract" the title, and leave everything before and after it as the content
 
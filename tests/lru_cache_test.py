@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import unittest
+
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.util import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache = LRUCache(2)
+    
+    def test_can_store_values(self):
+        self.cache.set('foo', 1)
+        assert_equals(1, self.cache.get('foo'))
+        assert_none(self.cache.get('bar'))
+        assert_equals(42, self.cache.get('bar', 42))
+    
+    def test_drops_least_recently_used_entry(self):
+        self.cache.set('foo', 1)
+        self.cache.set('bar', 2)
+        self.cache.get('foo')
+        self.cache.set('baz', 3)
+        
+        assert_length(2, self.cache)
+        assert_true('foo' in self.cache)
+        assert_false('bar' in self.cache)
+        assert_true('baz' in self.cache)
+    
+    def test_can_replace_values(self):
+        self.cache.set('foo', 1)
+        self.cache.set('bar', 2)
+        self.cache.set('foo', 3)
+        
+        assert_length(2, self.cache)
+        assert_equals(3, self.cache.get('foo'))
+    
+    def test_can_remove_entries(self):
+        self.cache.set('foo', 1)
+        self.cache.set('bar', 2)
+        assert_equals(1, self.cache.pop('foo'))
+        assert_none(self.cache.pop('foo'))
+        self.cache.clear()
+        assert_length(0, self.cache)
+
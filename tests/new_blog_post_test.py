@@ -30,10 +30,14 @@ from trac.attachment import Attachment
 from trac.test import EnvironmentStub, Mock
 from trac.versioncontrol.api import RepositoryManager
 from trac.wiki.model import WikiPage
-from trac_dev_platform.test import EnvironmentStub, TracTest
+from tractags.api import TagSystem
+from trac_dev_platform.test import EnvironmentStub, mock_request, TracTest
 from trac_dev_platform.test.lib.pythonic_testcase import *
 
+from trac_wiki_blog.index import BlogPostIndex
 from trac_wiki_blog.macro import ShowPostsMacro
+from trac_wiki_blog.util import unique_wiki_pagename, wiki_pagename_from_title
+from trac_wiki_blog.web_ui import NewBlogPostPage, PageNameTaken
 
 
 class NewBlogPostTest(TracTest):
@@ -106,6 +110,117 @@ class NewBlogPostTest(TracTest):
         assert_true(page.exists)
         assert_equals('= title =\n\nsome post', page.text)
     
+    def _submit_post(self, title, text='some post'):
+        req = self.post_request('/newblogpost', action='edit', save='Submit changes', blogtitle=title, text=text, tags='blog', version=0)
+        response = self.simulate_request(req)
+        assert_equals(303, response.code())
+        return response.header('Location')
+    
+    def _page_prefix(self):
+        today = date.today()
+        return '%d/%02d/' % (today.year, today.month)
+    
+    def test_appends_number_if_post_with_same_name_exists(self):
+        self.grant_permission('anonymous', 'TRAC_ADMIN')
+        self._submit_post('title', 'first')
+        self._submit_post('title', 'second')
+        location = self._submit_post('title', 'third')
+        
+        assert_true(location.endswith('/wiki/' + self._page_prefix() + 'title-3'))
+        assert_equals('= title =\n\nfirst', WikiPage(self.env, self._page_prefix() + 'title').text)
+        assert_equals('= title =\n\nsecond', WikiPage(self.env, self._page_prefix() + 'title-2').text)
+        assert_length(3, BlogPostIndex(self.env).post_names())
+    
+    def test_does_not_touch_post_which_was_saved_concurrently(self):
+        self.grant_permission('anonymous', 'TRAC_ADMIN')
+        req = mock_request('/')
+        req.populate(self.env)
+        new_post = NewBlogPostPage(self.env, 'Foo', req, ['blog', 'new'])
+        new_post.text = 'new'
+        other_post = WikiPage(self.env, 'Foo')
+        other_post.text = 'other'
+        other_post.save(None, None, '127.0.0.1')
+        
+        assert_raises(PageNameTaken, lambda: new_post.save(None, None, '127.0.0.1'))
+        assert_equals('other', WikiPage(self.env, 'Foo').text)
+        assert_equals(set(), TagSystem(self.env).get_tags(req, other_post.resource))
+    
+    def test_does_not_hide_errors_of_change_listeners(self):
+        def fail(page):
+            raise ValueError('listener failed')
+        index = BlogPostIndex(self.env)
+        index.wiki_page_added = fail
+        req = mock_request('/')
+        req.populate(self.env)
+        new_post = NewBlogPostPage(self.env, 'Foo', req, ['blog'])
+        new_post.text = 'new'
+        try:
+            assert_raises(ValueError, lambda: new_post.save(None, None, '127.0.0.1'))
+        finally:
+            del index.wiki_page_added
+        assert_true(WikiPage(self.env, 'Foo').exists)
+    
+    def test_retries_with_number_appended_to_original_page_name(self):
+        self.grant_permission('anonymous', 'TRAC_ADMIN')
+        self._create_page(self._page_prefix() + 'title')
+        taken_name = self._page_prefix() + 'title-2'
+        original_save = NewBlogPostPage.save
+        def save_concurrently(page, *args, **kwargs):
+            if page.name == taken_name and not WikiPage(self.env, taken_name).exists:
+                self._create_page(taken_name)
+            return original_save(page, *args, **kwargs)
+        NewBlogPostPage.save = save_concurrently
+        try:
+            location = self._submit_post('title')
+        finally:
+            NewBlogPostPage.save = original_save
+        
+        assert_true(location.endswith('/wiki/' + self._page_prefix() + 'title-3'))
+    
+    # --------------------------------------------------------------------------
+    # page names
+    
+    def test_page_name_contains_only_letters_digits_and_dashes(self):
+        assert_equals('hello-world', wiki_pagename_from_title(' Hello World '))
+        assert_equals('c-tips-tricks', wiki_pagename_from_title('C++: tips & tricks?'))
+        assert_equals('a-b-c', wiki_pagename_from_title('a/b/../c'))
+        assert_equals(u'\xfcber-caf\xe9', wiki_pagename_from_title(u'\xdcber Caf\xe9'))
+    
+    def test_page_name_is_never_empty(self):
+        assert_equals('post', wiki_pagename_from_title('!?!'))
+    
+    def test_limits_length_of_page_name(self):
+        assert_equals('some-long', wiki_pagename_from_title('some long title', max_length=12))
+        assert_equals('abcdef', wiki_pagename_from_title('abcdefghij', max_length=6))
+        assert_equals(60, len(wiki_pagename_from_title('x' * 100)))
+    
+    def _create_page(self, name):
+        page = WikiPage(self.env, name)
+        page.text = 'text'
+        page.save(None, None, '127.0.0.1')
+    
+    def test_unique_page_name_uses_lowest_free_number(self):
+        assert_equals('foo', unique_wiki_pagename(self.env, 'foo'))
+        for name in ('foo', 'foo-2', 'foo-3', 'foo-5', 'foo-bar', 'foobar-9', 'foo.4'):
+            self._create_page(name)
+        
+        assert_equals('foo-4', unique_wiki_pagename(self.env, 'foo'))
+        assert_equals('foo-bar-2', unique_wiki_pagename(self.env, 'foo-bar'))
+    
+    def test_unique_page_name_does_not_count_from_year_in_page_name(self):
+        for name in ('release', 'release-2011'):
+            self._create_page(name)
+        assert_equals('release-2', unique_wiki_pagename(self.env, 'release'))
+    
+    def test_unique_page_name_is_case_sensitive(self):
+        self._create_page('Foo')
+        assert_equals('foo', unique_wiki_pagename(self.env, 'foo'))
+    
+    def test_unique_page_name_escapes_wildcards(self):
+        for name in ('a_b', 'axb-3'):
+            self._create_page(name)
+        assert_equals('a_b-2', unique_wiki_pagename(self.env, 'a_b'))
+    
     # --------------------------------------------------------------------------
     # nav item
     
@@ -33,15 +33,18 @@ import datetime
 import random
 import unittest
 
+from trac.perm import PermissionSystem
 from trac.util.datefmt import utc
 from trac.test import Mock, EnvironmentStub, MockPerm
 from trac.web.href import Href
 from trac.wiki.model import WikiPage
 from tractags.api import TagSystem
+from trac_dev_platform import test as dev_platform_test
 from trac_dev_platform.test.lib.pythonic_testcase import *
 
-from trac_wiki_blog.util import creation_date_of_page, load_pages_with_tags, \
-    sort_by_creation_date, paginate_page_list
+from trac_wiki_blog.util import creation_date_of_page, \
+    creation_dates_of_pages, load_pages_with_tags, sort_by_creation_date, \
+    paginate_page_list, parallel_map
 
 
 
@@ -67,6 +70,34 @@ def create_tagged_page(env, req, name, text, tags):
     return page
 
 
+class BlogFixture(object):
+    """Mixin for test cases which need an environment with the blog enabled
+    where the anonymous user may do everything."""
+    
+    # additional components to enable, e.g. permission policies
+    extra_components = ()
+    
+    def setUp(self):
+        enable = ('trac_wiki_blog.*', 'tractags.*', 'trac.*') + tuple(self.extra_components)
+        self.env = dev_platform_test.EnvironmentStub(default_data=True, enable=enable)
+        self.env.upgrade()
+        PermissionSystem(self.env).grant_permission('anonymous', 'TRAC_ADMIN')
+    
+    def tearDown(self):
+        self.env.destroy_temp_directory()
+    
+    def req(self):
+        req = dev_platform_test.mock_request('/')
+        req.populate(self.env)
+        return req
+    
+    def _create_tagged_page(self, name, text='= Title =\ncontent', 
+                            tags=('blog',), when=None):
+        page = create_tagged_page(self.env, self.req(), name, text, tags)
+        page.save('author', 'comment', '127.0.0.1', when)
+        return WikiPage(self.env, name)
+
+
 class PostFinderTest(unittest.TestCase):
     
     def setUp(self):
@@ -104,6 +135,21 @@ class PostFinderTest(unittest.TestCase):
         assert_not_equals(long_ago, page.time)
         assert_equals(long_ago, creation_date_of_page(page))
     
+    def test_can_get_creation_dates_of_several_pages_at_once(self):
+        long_ago = datetime.datetime(year=2000, month=1, day=1, tzinfo=utc)
+        page = create_tagged_page(self.env, self.req, "name", "text", ["blog"])
+        page.save("author", "comment", "remote_address", long_ago)
+        page.text = "version 2"
+        page.save("author", "comment", "remote_address")
+        pagelist = create_tagged_pages(self.env, self.req, ["blog"], 2)
+        
+        pagenames = ["name"] + [page.name for page in pagelist] + ["missing"]
+        creation_dates = creation_dates_of_pages(self.env, pagenames)
+        assert_equals(3, len(creation_dates))
+        assert_equals(long_ago, creation_dates["name"])
+        for page in pagelist:
+            assert_equals(creation_date_of_page(page), creation_dates[page.name])
+    
     def resource_ids(self, list_of_objects):
         return [item.resource for item in list_of_objects]
     
@@ -120,5 +166,15 @@ class PostFinderTest(unittest.TestCase):
     def test_can_get_paginated_page_list(self):
         page_list = create_tagged_pages(self.env, self.req, ["fnord"], 4)
         assert_equals(page_list[0:2], paginate_page_list(page_list, 0, 2))
-
-
+        assert_equals(page_list[2:4], paginate_page_list(page_list, 2, 2))
+    
+    def test_parallel_map_keeps_order_of_items(self):
+        assert_equals([i * 2 for i in range(20)], 
+                      parallel_map(lambda i: i * 2, range(20), workers=4))
+    
+    def test_parallel_map_reraises_exceptions(self):
+        def fail_for_odd_numbers(i):
+            if i % 2:
+                raise ValueError(i)
+            return i
+        assert_raises(ValueError, lambda: parallel_map(fail_for_odd_numbers, range(5), 3))
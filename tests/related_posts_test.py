@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import datetime
+import unittest
+
+from BeautifulSoup import BeautifulSoup
+from trac.resource import Resource
+from trac.test import Mock
+from trac.util.datefmt import utc
+from tractags.api import TagSystem
+from trac_dev_platform.test import TracTest
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.macro import RelatedPostsMacro
+from trac_wiki_blog.related import RelatedPostsIndex
+
+from post_finder_test import BlogFixture
+
+
+class RelatedPostsTest(BlogFixture, TracTest):
+    
+    def setUp(self):
+        super(RelatedPostsTest, self).setUp()
+        self.related = RelatedPostsIndex(self.env)
+        self.day = 0
+    
+    def _create_post(self, name, *tags):
+        self.day += 1
+        return self._create_tagged_page(name, '= %s =\ncontent' % name, ('blog',) + tags, 
+                                        when=datetime.datetime(2011, 5, self.day, tzinfo=utc))
+    
+    def _related(self, name, limit=5):
+        return [post.name for post in self.related.related_posts(self.req(), name, limit)]
+    
+    def test_orders_posts_by_number_of_shared_tags(self):
+        self._create_post('Foo', 'trac', 'python', 'release')
+        self._create_post('Bar', 'trac', 'python')
+        self._create_post('Baz', 'trac')
+        self._create_post('Qux', 'trac', 'release')
+        self._create_post('Other', 'cooking')
+        
+        assert_equals(['Qux', 'Bar', 'Baz'], self._related('Foo'))
+        # newer posts first if the same number of tags is shared
+        assert_equals(['Qux', 'Bar'], self._related('Baz', limit=2))
+        assert_equals([], self._related('Other'))
+    
+    def test_blog_tag_does_not_make_posts_related(self):
+        self._create_post('Foo')
+        self._create_post('Bar')
+        assert_equals([], self._related('Foo'))
+    
+    def test_updates_scores_when_tags_change(self):
+        self._create_post('Foo', 'trac')
+        page = self._create_post('Bar', 'python')
+        assert_equals([], self._related('Foo'))
+        
+        TagSystem(self.env).add_tags(self.req(), page.resource, ['trac'])
+        page.text = 'changed'
+        page.save('author', None, '127.0.0.1')
+        assert_equals(['Bar'], self._related('Foo'))
+        
+        page.delete()
+        assert_equals([], self._related('Foo'))
+    
+    def test_can_rebuild_scores(self):
+        self._create_post('Foo', 'trac')
+        self._create_post('Bar', 'trac')
+        db = self.env.get_db_cnx()
+        db.cursor().execute("DELETE FROM blog_related")
+        db.commit()
+        
+        self.related.rebuild()
+        assert_equals(['Bar'], self._related('Foo'))
+    
+    def _expand_macro(self, pagename, argument_string=''):
+        formatter = Mock(req=self.req(), context=Mock(resource=Resource('wiki', pagename)))
+        return unicode(RelatedPostsMacro(self.env).expand_macro(formatter, 'RelatedPosts', argument_string))
+    
+    def test_macro_links_to_related_posts(self):
+        self._create_post('Foo', 'trac')
+        self._create_post('Bar', 'trac')
+        self._create_post('Baz', 'trac')
+        
+        items = BeautifulSoup(self._expand_macro('Foo', '1')).findAll('li')
+        assert_equals(['/wiki/Baz'], [item.a['href'] for item in items])
+        assert_equals(['Baz'], [item.a.string for item in items])
+    
+    def test_macro_can_show_posts_related_to_other_page(self):
+        self._create_post('Foo', 'trac')
+        self._create_post('Bar', 'trac')
+        
+        html = self._expand_macro('WikiStart', 'page=Foo')
+        assert_equals(['/wiki/Bar'], [link['href'] for link in BeautifulSoup(html).findAll('a')])
+        assert_equals('', self._expand_macro('WikiStart'))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import unittest
+
+from trac.test import Mock
+from trac_dev_platform.test.lib.pythonic_testcase import *
+
+from trac_wiki_blog.cache import RenderCache
+from trac_wiki_blog.macro import ShowPostsMacro
+
+from post_finder_test import BlogFixture
+
+
+class RenderCacheTest(BlogFixture, unittest.TestCase):
+    
+    def setUp(self):
+        super(RenderCacheTest, self).setUp()
+        self.cache = RenderCache(self.env)
+    
+    def _create_post(self, name='Foo', text='= Title =\ncontent'):
+        return self._create_tagged_page(name, text)
+    
+    def _expand_macro(self):
+        formatter = Mock(req=self.req())
+        return ShowPostsMacro(self.env).expand_macro(formatter, 'ShowPosts', '')
+    
+    def _cached_body(self, page):
+        settings = self.cache.settings_key(self.req())
+        return self.cache.get(page.name, page.version, 'body', settings)
+    
+    def test_stores_rendered_html(self):
+        page = self._create_post()
+        assert_none(self._cached_body(page))
+        
+        self._expand_macro()
+        assert_contains('content', self._cached_body(page))
+    
+    def test_uses_cached_html_for_unchanged_posts(self):
+        page = self._create_post()
+        settings = self.cache.settings_key(self.req())
+        self.cache.set(page.name, page.version, 'body', settings, u'<p>from cache</p>')
+        
+        assert_contains('from cache', self._expand_macro())
+    
+    def test_removes_cached_html_when_page_is_changed(self):
+        page = self._create_post()
+        self._expand_macro()
+        assert_not_none(self._cached_body(page))
+        
+        page.text = '= Title =\nnew content'
+        page.save(None, None, '127.0.0.1')
+        assert_none(self._cached_body(page))
+        assert_contains('new content', self._expand_macro())
+    
+    def test_removes_cached_html_when_page_is_deleted(self):
+        page = self._create_post()
+        self._expand_macro()
+        page.delete()
+        assert_none(self._cached_body(page))
+    
+    def test_settings_key_depends_on_formatter_configuration(self):
+        settings = self.cache.settings_key(self.req())
+        self.env.config.set('wiki', 'render_unsafe_content', 'true')
+        assert_not_equals(settings, self.cache.settings_key(self.req()))
+    
+    def test_can_disable_cache(self):
+        self.env.config.set('wiki-blog', 'render_cache', 'false')
+        page = self._create_post()
+        self._expand_macro()
+        assert_none(self._cached_body(page))
+
@@ -26,16 +26,22 @@
 #   - Felix Schwarz
 
 from cStringIO import StringIO
+import datetime
 import re
 import unittest
 
 from BeautifulSoup import BeautifulSoup
+from genshi.builder import Markup
 from trac.attachment import Attachment
+from trac.core import TracError
 from trac.test import EnvironmentStub, Mock
+from trac.util.datefmt import utc
 from trac.wiki.model import WikiPage
 from trac_dev_platform.test import EnvironmentStub, mock_request, TracTest
 from trac_dev_platform.test.lib.pythonic_testcase import *
 
+from trac_wiki_blog.cache import BlogCache, RenderCache
+from trac_wiki_blog.index import BlogPostIndex
 from trac_wiki_blog.macro import ShowPostsMacro
 
 from post_finder_test import create_tagged_page
@@ -56,8 +62,10 @@ class ShowPostsMacroTest(unittest.TestCase):
         req.populate(self.env)
         return req
     
-    def _expand_macro(self, argument_string=''):
-        formatter = Mock(req=self.req())
+    def _expand_macro(self, argument_string='', **request_args):
+        req = self.req()
+        req.args.update(request_args)
+        formatter = Mock(req=req)
         html = self.macro.expand_macro(formatter, 'ShowPosts', argument_string)
         return html
     
@@ -80,6 +88,13 @@ class ShowPostsMacroTest(unittest.TestCase):
     def test_strips_spaces_from_macro_title(self):
         title = self._title_from_html(self._expand_macro(u'title= A Title '))
         assert_equals(u'A Title', title)
+    
+    def test_macro_title_may_contain_commas(self):
+        title = self._title_from_html(self._expand_macro(u'title=Hello, World'))
+        assert_equals(u'Hello, World', title)
+        
+        html = self._expand_macro(u'title=Hello, World, per_page=5')
+        assert_equals(u'Hello, World', self._title_from_html(html))
 
     # --------------------------------------------------------------------------
     # Relative attachment links
@@ -151,4 +166,209 @@ class ShowPostsMacroTest(unittest.TestCase):
         assert_not_none(post_link)
         assert_equals('Some Title', post_link.text)
         # Section linking is a JS feature so we can't test it here…
+    
+    def test_uses_page_name_as_title_of_posts_without_heading(self):
+        self._grant_permission('anonymous', 'TRAC_ADMIN')
+        page = create_tagged_page(self.env, self.req(), 'Foo', "just ''content''", ('blog',))
+        page.save(None, None, '127.0.0.1')
+        
+        soup = BeautifulSoup(self._expand_macro())
+        assert_equals('Foo', soup.find('a', href='/wiki/Foo').text)
+        assert_equals('content', soup.find(['i', 'em']).text)
 
+    
+    # --------------------------------------------------------------------------
+    # Pagination
+    
+    def _create_posts(self, number_of_posts):
+        self._grant_permission('anonymous', 'TRAC_ADMIN')
+        creation_date = datetime.datetime(year=2000, month=1, day=1, tzinfo=utc)
+        for i in range(number_of_posts):
+            page = create_tagged_page(self.env, self.req(), 'Post%d' % i, 
+                                      '= Post %d =\ncontent' % i, ('blog',))
+            creation_date += datetime.timedelta(days=1)
+            page.save(None, None, '127.0.0.1', creation_date)
+    
+    def _post_links(self, html):
+        links = BeautifulSoup(html).findAll('a', href=re.compile('^/wiki/Post'))
+        return [link['href'] for link in links if link.string == 'Read Post']
+    
+    def test_shows_only_configured_number_of_posts(self):
+        self._create_posts(3)
+        html = self._expand_macro('per_page=2')
+        assert_equals(['/wiki/Post2', '/wiki/Post1'], self._post_links(html))
+    
+    def test_can_display_older_posts(self):
+        self._create_posts(3)
+        html = self._expand_macro('per_page=2', blog_page='2')
+        assert_equals(['/wiki/Post0'], self._post_links(html))
+        
+        html = self._expand_macro('per_page=2, page=2')
+        assert_equals(['/wiki/Post0'], self._post_links(html))
+    
+    def test_links_to_older_and_newer_posts(self):
+        self._create_posts(3)
+        soup = BeautifulSoup(self._expand_macro('per_page=2'))
+        assert_none(soup.find('a', attrs={'class': 'blog_newer_posts'}))
+        older_link = soup.find('a', attrs={'class': 'blog_older_posts'})
+        assert_contains('blog_page=2', older_link['href'])
+        
+        soup = BeautifulSoup(self._expand_macro('per_page=2', blog_page='2'))
+        assert_none(soup.find('a', attrs={'class': 'blog_older_posts'}))
+        newer_link = soup.find('a', attrs={'class': 'blog_newer_posts'})
+        assert_contains('blog_page=1', newer_link['href'])
+    
+    # --------------------------------------------------------------------------
+    # Excerpts
+    
+    def _create_post_with_teaser(self):
+        self._grant_permission('anonymous', 'TRAC_ADMIN')
+        page = create_tagged_page(self.env, self.req(), 'Foo', 
+                                  '= Title =\nteaser\n[[more]]\nsecret', ('blog',))
+        page.save(None, None, '127.0.0.1')
+    
+    def test_shows_complete_posts_by_default(self):
+        self._create_post_with_teaser()
+        html = self._expand_macro()
+        assert_contains('teaser', html)
+        assert_contains('secret', html)
+        assert_false('[[more]]' in html)
+        assert_false('system-message' in html)
+    
+    def test_can_show_only_excerpt(self):
+        self._create_post_with_teaser()
+        html = self._expand_macro('excerpt=more')
+        assert_contains('teaser', html)
+        assert_false('secret' in html)
+    
+    def test_rejects_invalid_excerpt(self):
+        self._create_post_with_teaser()
+        assert_raises(TracError, lambda: self._expand_macro('excerpt=foo'))
+    
+    # --------------------------------------------------------------------------
+    # Parallel rendering
+    
+    def test_can_render_posts_in_parallel(self):
+        self.env.config.set('wiki-blog', 'output_cache', 'false')
+        self._create_posts(5)
+        sequential_html = self._expand_macro('per_page=5')
+        RenderCache(self.env).clear()
+        self.env.config.set('wiki-blog', 'render_workers', '3')
+        
+        html = self._expand_macro('per_page=5')
+        assert_equals(['/wiki/Post4', '/wiki/Post3', '/wiki/Post2', 
+                       '/wiki/Post1', '/wiki/Post0'], self._post_links(html))
+        assert_equals(sequential_html, html)
+    
+    # --------------------------------------------------------------------------
+    # Rendering
+    
+    def test_returns_rendered_markup(self):
+        # Trac 0.12's formatter converts macro output to a string immediately
+        self._create_posts(1)
+        req = self.req()
+        output = self.macro.expand_macro(Mock(req=req), 'ShowPosts', '')
+        assert_true(isinstance(output, Markup))
+        assert_contains('/wiki/Post0', output)
+        cache = RenderCache(self.env)
+        assert_not_none(cache.get('Post0', 1, 'body', cache.settings_key(req)))
+    
+    def test_output_contains_no_doctype(self):
+        self._create_posts(1)
+        assert_true(self._expand_macro().startswith('<div>'))
+    
+    # --------------------------------------------------------------------------
+    # Output cache
+    
+    def _change_text_behind_the_scenes(self, name, text):
+        # no change listeners are notified so caches are not invalidated
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute("UPDATE wiki SET text=%s WHERE name=%s", (text, name))
+        db.commit()
+        RenderCache(self.env).clear()
+        self.macro._parsed_posts.clear()
+    
+    def test_reuses_rendered_output(self):
+        self._create_posts(1)
+        html = self._expand_macro()
+        self._change_text_behind_the_scenes('Post0', '= Post 0 =\nchanged')
+        
+        assert_equals(html, self._expand_macro())
+        assert_not_equals(html, self._expand_macro('title=Other Title'))
+    
+    def test_renders_again_after_post_was_changed(self):
+        self._create_posts(1)
+        self._expand_macro()
+        
+        page = WikiPage(self.env, 'Post0')
+        page.text = '= Post 0 =\nchanged'
+        page.save(None, None, '127.0.0.1')
+        assert_contains('changed', self._expand_macro())
+    
+    def test_renders_again_when_blog_cache_is_invalidated(self):
+        self._create_posts(1)
+        self._expand_macro()
+        db = self.env.get_db_cnx()
+        db.cursor().execute("UPDATE wiki SET text=%s WHERE name=%s", 
+                            ('= Post 0 =\nchanged', 'Post0'))
+        db.commit()
+        RenderCache(self.env).clear()
+        
+        BlogCache(self.env).invalidate()
+        assert_contains('changed', self._expand_macro())
+    
+    def test_does_not_reuse_parsed_post_of_page_created_again(self):
+        self.env.config.set('wiki-blog', 'output_cache', 'false')
+        self._create_posts(1)
+        assert_contains('content', self._expand_macro())
+        
+        # another Trac process deleted the page and created it again
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute("UPDATE wiki SET text=%s, time=time+1000000 WHERE name=%s", 
+                       ('= Post 0 =\nrecreated', 'Post0'))
+        db.commit()
+        RenderCache(self.env).invalidate('Post0')
+        BlogPostIndex(self.env).update('Post0')
+        
+        assert_contains('recreated', self._expand_macro())
+    
+    def test_can_disable_output_cache(self):
+        self.env.config.set('wiki-blog', 'output_cache', 'false')
+        self._create_posts(1)
+        self._expand_macro()
+        self._change_text_behind_the_scenes('Post0', '= Post 0 =\nchanged')
+        
+        assert_contains('changed', self._expand_macro())
+    
+    # --------------------------------------------------------------------------
+    # Tag filters
+    
+    def _create_post_with_tags(self, name, *tags):
+        self._grant_permission('anonymous', 'TRAC_ADMIN')
+        page = create_tagged_page(self.env, self.req(), name, 
+                                  '= %s =\ncontent' % name, ('blog',) + tags)
+        page.save(None, None, '127.0.0.1')
+    
+    def _shown_posts(self, html):
+        links = BeautifulSoup(html).findAll('a', href=re.compile('^/wiki/'))
+        return sorted([link['href'] for link in links if link.string == 'Read Post'])
+    
+    def test_can_show_only_posts_with_given_tags(self):
+        self._create_post_with_tags('Foo', 'release')
+        self._create_post_with_tags('Bar', 'release', 'security')
+        self._create_post_with_tags('Baz')
+        
+        assert_equals(['/wiki/Bar', '/wiki/Foo'], 
+                      self._shown_posts(self._expand_macro('tags=release')))
+        assert_equals(['/wiki/Bar'], 
+                      self._shown_posts(self._expand_macro('tags=release security')))
+    
+    def test_can_filter_posts_with_tag_query(self):
+        self._create_post_with_tags('Foo', 'release')
+        self._create_post_with_tags('Bar', 'security', 'draft')
+        self._create_post_with_tags('Baz', 'security')
+        
+        html = self._expand_macro('query=release or security -draft')
+        assert_equals(['/wiki/Baz', '/wiki/Foo'], self._shown_posts(html))
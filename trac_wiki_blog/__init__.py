@@ -1,5 +1,13 @@
 
+from trac_wiki_blog.admin import *
+from trac_wiki_blog.cache import *
+from trac_wiki_blog.db import *
+from trac_wiki_blog.index import *
 from trac_wiki_blog.macro import *
+from trac_wiki_blog.model import *
+from trac_wiki_blog.related import *
+from trac_wiki_blog.search import *
+from trac_wiki_blog.stats import *
 from trac_wiki_blog.web_ui import *
 
 
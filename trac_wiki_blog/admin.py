@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.core import Component, implements
+from trac.perm import PermissionCache
+from trac.util.datefmt import utc
+from trac.util.text import printout
+from trac.util.translation import get_negotiated_locale
+from trac.wiki.model import WikiPage
+
+from trac_wiki_blog.cache import BlogCache, RenderCache
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.macro import ShowPostsMacro
+from trac_wiki_blog.util import parallel_map
+
+
+__all__ = ['BlogAdminCommands']
+
+
+class RenderRequest(object):
+    """Minimal stand-in for a web request so blog posts can be rendered by 
+    trac-admin exactly like they are for an (anonymous) visitor."""
+    
+    def __init__(self, env, authname='anonymous'):
+        self.href = env.href
+        self.abs_href = env.abs_href
+        self.authname = authname
+        self.perm = PermissionCache(env, authname)
+        self.args = {}
+        self.chrome = dict(links={}, scripts=[], ctxtnav=[], warnings=[], notices=[])
+        self.session = {}
+        self.tz = utc
+        # anonymous users get the default language if it is configured
+        default_language = env.config.get('trac', 'default_language')
+        self.locale = get_negotiated_locale([default_language])
+
+
+class BlogAdminCommands(Component):
+    """trac-admin commands to rebuild and check the blog index and the render
+    cache (e.g. after restoring a backup or editing the database directly)."""
+    
+    implements(IAdminCommandProvider)
+    
+    batch_size = 100
+    
+    # IAdminCommandProvider
+    def get_admin_commands(self):
+        yield ('blog rebuild-index', '',
+               'Rebuild the index of all blog posts',
+               None, self._do_rebuild_index)
+        yield ('blog warm-cache', '[workers]',
+               """Render all blog posts which are not in the render cache yet
+               
+               The optional number of workers controls how many posts are
+               rendered concurrently (default: 1).""",
+               None, self._do_warm_cache)
+        yield ('blog verify', '',
+               'Check that the blog index and the render cache are up to date',
+               None, self._do_verify)
+    
+    def _do_rebuild_index(self):
+        index = BlogPostIndex(self.env)
+        db = self.env.get_db_cnx()
+        number_of_posts = 0
+        for pagenames in index.tagged_page_names(self.batch_size, db):
+            for name in pagenames:
+                index.update(name, db)
+            db.commit()
+            number_of_posts += len(pagenames)
+            printout('Indexed %d blog posts' % number_of_posts)
+        removed_entries = index.remove_stale_entries(db)
+        db.commit()
+        printout('Removed %d stale entries' % removed_entries)
+        index.rebuild_archive(db)
+        index.rebuild_tag_counts(db)
+        removed_html = RenderCache(self.env).remove_outdated_entries(db)
+        printout('Removed %d outdated render cache entries' % removed_html)
+        BlogCache(self.env).invalidate(db)
+        db.commit()
+    
+    def _do_warm_cache(self, workers='1'):
+        try:
+            workers = int(workers)
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            raise AdminCommandError('Number of workers must be a positive integer')
+        if not RenderCache(self.env).enabled:
+            raise AdminCommandError('The render cache is disabled in trac.ini')
+        
+        req = RenderRequest(self.env)
+        cache_settings = RenderCache(self.env).settings_key(req)
+        render = lambda name: self._render_post(req, name, cache_settings)
+        number_of_posts = 0
+        for pagenames in BlogPostIndex(self.env).tagged_page_names(self.batch_size):
+            parallel_map(render, pagenames, workers)
+            number_of_posts += len(pagenames)
+            printout('Rendered %d blog posts' % number_of_posts)
+    
+    def _do_verify(self):
+        index = BlogPostIndex(self.env)
+        db = self.env.get_db_cnx()
+        number_of_posts = 0
+        problems = 0
+        for pagenames in index.tagged_page_names(self.batch_size, db):
+            for name in pagenames:
+                if not index.is_up_to_date(name, db):
+                    printout('Index entry for %s is outdated' % name)
+                    problems += 1
+            number_of_posts += len(pagenames)
+        
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*) FROM blog_post WHERE name NOT IN "
+                       "(SELECT name FROM tags WHERE tagspace=%s AND tag=%s)",
+                       ('wiki', index.blog_tag))
+        stale_entries = cursor.fetchone()[0]
+        if stale_entries:
+            printout('%d index entries do not belong to a blog post' % stale_entries)
+            problems += stale_entries
+        if not index.archive_is_up_to_date(db):
+            printout('Number of posts in the archive is outdated')
+            problems += 1
+        cursor.execute("SELECT COUNT(*) FROM blog_render_cache c LEFT OUTER JOIN "
+                       "blog_post p ON p.name=c.name WHERE p.version IS NULL "
+                       "OR p.version != c.version")
+        outdated_html = cursor.fetchone()[0]
+        if outdated_html:
+            printout('%d render cache entries are outdated' % outdated_html)
+            problems += outdated_html
+        
+        printout('Checked %d blog posts' % number_of_posts)
+        if problems:
+            raise AdminCommandError('Found %d problems, run "blog rebuild-index" '
+                                    'and "blog warm-cache" to fix them' % problems)
+    
+    def _render_post(self, req, name, cache_settings):
+        page = WikiPage(self.env, name)
+        try:
+            ShowPostsMacro(self.env).render_post(req, page, cache_settings)
+        except Exception, e:
+            printout('Unable to render %s: %s' % (name, e))
+    
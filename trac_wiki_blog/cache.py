@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+import os
+import shutil
+import tempfile
+import time
+
+from trac.attachment import IAttachmentChangeListener
+from trac.config import BoolOption, ExtensionOption, IntOption, Option
+from trac.core import Component, implements, Interface
+from trac.perm import PermissionSystem
+from trac.wiki.api import IWikiChangeListener
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.stats import get_db_cnx
+from trac_wiki_blog.util import LRUCache
+
+
+__all__ = ['BlogCache', 'DatabaseCacheBackend', 'FileSystemCacheBackend', 
+           'IBlogCacheBackend', 'MemoryCacheBackend', 'RenderCache']
+
+
+# Configuration options which influence the HTML generated by the wiki 
+# formatter. Changing one of these must not return stale HTML from the cache.
+_formatter_options = (
+    ('wiki', 'ignore_missing_pages'),
+    ('wiki', 'render_unsafe_content'),
+    ('wiki', 'safe_schemes'),
+    ('wiki', 'split_page_names'),
+)
+
+
+class RenderCache(Component):
+    """Stores the rendered HTML of blog posts in the database so unchanged 
+    posts don't need to go through the wiki formatter again. 
+    
+    Cache entries are keyed by page name, version, the rendered fragment 
+    (e.g. 'title' or 'body') and a digest of all settings which influence the
+    formatter output. They are removed whenever the page or one of its 
+    attachments changes."""
+    
+    implements(IAttachmentChangeListener, IWikiChangeListener)
+    
+    enabled = BoolOption('wiki-blog', 'render_cache', True,
+        """Cache the HTML of rendered blog posts in the database.""")
+    
+    def settings_key(self, req):
+        """Return a digest of everything (besides the page itself) which 
+        influences the HTML generated for the given request."""
+        permissions = PermissionSystem(self.env).get_user_permissions(req.authname)
+        granted_actions = sorted([action for action, is_granted 
+                                  in permissions.items() if is_granted])
+        settings = [req.href(), unicode(getattr(req, 'locale', None)), granted_actions]
+        for section, name in _formatter_options:
+            settings.append(self.config.get(section, name))
+        # permission policies may treat users with the same permissions 
+        # differently (e.g. links to pages only some of them may see)
+        if BlogPostIndex(self.env)._has_page_specific_permissions():
+            settings.append(req.authname)
+        return md5(repr(settings)).hexdigest()
+    
+    def get(self, name, version, fragment, settings):
+        if not self.enabled:
+            return None
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT html FROM blog_render_cache WHERE name=%s AND "
+                       "version=%s AND fragment=%s AND settings=%s",
+                       (name, version, fragment, settings))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+    
+    def set(self, name, version, fragment, settings, html):
+        if not self.enabled:
+            return
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        try:
+            cursor.execute("INSERT INTO blog_render_cache (name, version, "
+                           "fragment, settings, html) VALUES (%s, %s, %s, %s, %s)",
+                           (name, version, fragment, settings, html))
+            db.commit()
+        except Exception, e:
+            # Most likely another request stored the same item concurrently. 
+            # Not being able to cache something is never a fatal problem.
+            db.rollback()
+            self.log.debug('Unable to cache HTML for page %s: %s', name, e)
+    
+    def invalidate(self, name):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_render_cache WHERE name=%s", (name,))
+        db.commit()
+    
+    def remove_outdated_entries(self, db=None):
+        """Remove the HTML of all pages which are no indexed blog posts or
+        which were changed since. Returns the number of removed entries."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_render_cache WHERE NOT EXISTS "
+                       "(SELECT * FROM blog_post p WHERE p.name=blog_render_cache.name "
+                       "AND p.version=blog_render_cache.version)")
+        removed_entries = cursor.rowcount
+        if handle_ta:
+            db.commit()
+        return removed_entries
+    
+    def clear(self):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_render_cache")
+        db.commit()
+    
+    # IWikiChangeListener
+    def wiki_page_added(self, page):
+        self.invalidate(page.name)
+    
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self.invalidate(page.name)
+    
+    def wiki_page_deleted(self, page):
+        self.invalidate(page.name)
+    
+    def wiki_page_version_deleted(self, page):
+        self.invalidate(page.name)
+    
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate(old_name)
+    
+    # IAttachmentChangeListener
+    def attachment_added(self, attachment):
+        if attachment.parent_realm == 'wiki':
+            self.invalidate(attachment.parent_id)
+    
+    def attachment_deleted(self, attachment):
+        if attachment.parent_realm == 'wiki':
+            self.invalidate(attachment.parent_id)
+    
+    def attachment_reparented(self, attachment, old_parent_realm, old_parent_id):
+        if old_parent_realm == 'wiki':
+            self.invalidate(old_parent_id)
+        self.attachment_added(attachment)
+
+
+class IBlogCacheBackend(Interface):
+    """Stores HTML fragments for BlogCache. Which backend is used is 
+    configured with `[wiki-blog] cache_backend`.
+    
+    Keys are hex digests, values are unicode strings. Each entry belongs to a 
+    cache generation: Entries of older generations are never requested again
+    so backends only need to drop them eventually."""
+    
+    def get(key, generation):
+        """Return the value stored for key and generation (None if there is 
+        no such entry or it expired)."""
+    
+    def set(key, generation, value, timeout):
+        """Store the value which must not be returned after timeout seconds."""
+    
+    def discard_generations_before(generation):
+        """Called after the cache generation was increased."""
+
+
+class BlogCache(Component):
+    """Cache for rendered blog fragments which is shared by all Trac 
+    processes of an environment (depending on the configured backend).
+    
+    Every change of a wiki page or attachment increases the cache generation
+    which is stored in the database so each process notices the change with
+    its next lookup."""
+    
+    implements(IAttachmentChangeListener, IWikiChangeListener)
+    
+    backend = ExtensionOption('wiki-blog', 'cache_backend', IBlogCacheBackend,
+        'MemoryCacheBackend',
+        """Where rendered blog fragments are cached: `MemoryCacheBackend` 
+        (separately in each process), `DatabaseCacheBackend` or 
+        `FileSystemCacheBackend` (shared by all processes).""")
+    
+    generation_key = 'wiki_blog_cache_generation'
+    
+    def generation(self, db=None):
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name=%s", (self.generation_key,))
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        return int(row[0])
+    
+    def get(self, key, generation):
+        """Return the cached value for the given key (any object with a stable
+        repr) or None."""
+        return self.backend.get(self._digest(key), generation)
+    
+    def set(self, key, generation, value, timeout):
+        self.backend.set(self._digest(key), generation, value, timeout)
+    
+    def invalidate(self, db=None):
+        """Start a new cache generation so no process uses the cached values
+        anymore."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        # The conditional update makes sure that concurrent invalidations 
+        # do not end up with the same generation.
+        while True:
+            generation = self.generation(db)
+            cursor.execute("UPDATE system SET value=%s WHERE name=%s AND value=%s",
+                           (str(generation + 1), self.generation_key, str(generation)))
+            if cursor.rowcount != 0:
+                break
+            if generation == 0 and not self._generation_exists(db):
+                cursor.execute("INSERT INTO system (name, value) VALUES (%s, %s)",
+                               (self.generation_key, '1'))
+                break
+        if handle_ta:
+            db.commit()
+        self.backend.discard_generations_before(generation + 1)
+    
+    def _generation_exists(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*) FROM system WHERE name=%s", (self.generation_key,))
+        return cursor.fetchone()[0] != 0
+    
+    def _digest(self, key):
+        return md5(repr(key)).hexdigest()
+    
+    # IWikiChangeListener
+    def wiki_page_added(self, page):
+        self.invalidate()
+    
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self.invalidate()
+    
+    def wiki_page_deleted(self, page):
+        self.invalidate()
+    
+    def wiki_page_version_deleted(self, page):
+        self.invalidate()
+    
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate()
+    
+    # IAttachmentChangeListener
+    def attachment_added(self, attachment):
+        if attachment.parent_realm == 'wiki':
+            self.invalidate()
+    
+    def attachment_deleted(self, attachment):
+        if attachment.parent_realm == 'wiki':
+            self.invalidate()
+    
+    def attachment_reparented(self, attachment, old_parent_realm, old_parent_id):
+        self.invalidate()
+
+
+class MemoryCacheBackend(Component):
+    """Keeps the cached values in the memory of each process (least recently
+    used values are dropped first)."""
+    
+    implements(IBlogCacheBackend)
+    
+    size = IntOption('wiki-blog', 'memory_cache_size', 50,
+        """Number of values kept by the `MemoryCacheBackend`.""")
+    
+    def __init__(self):
+        self._cache = LRUCache(max(self.size, 1))
+    
+    # IBlogCacheBackend
+    def get(self, key, generation):
+        expires, value = self._cache.get((key, generation), (0, None))
+        if expires < time.time():
+            return None
+        return value
+    
+    def set(self, key, generation, value, timeout):
+        self._cache.set((key, generation), (time.time() + timeout, value))
+    
+    def discard_generations_before(self, generation):
+        self._cache.clear()
+
+
+class DatabaseCacheBackend(Component):
+    """Stores the cached values in the Trac database."""
+    
+    implements(IBlogCacheBackend)
+    
+    # IBlogCacheBackend
+    def get(self, key, generation):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM blog_cache WHERE id=%s AND "
+                       "generation=%s AND expires>%s", 
+                       (key, generation, int(time.time())))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+    
+    def set(self, key, generation, value, timeout):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        now = int(time.time())
+        try:
+            cursor.execute("DELETE FROM blog_cache WHERE id=%s OR expires<=%s", 
+                           (key, now))
+            cursor.execute("INSERT INTO blog_cache (id, generation, expires, "
+                           "value) VALUES (%s, %s, %s, %s)", 
+                           (key, generation, now + timeout, value))
+            db.commit()
+        except Exception, e:
+            # same as for the RenderCache: another request was faster
+            db.rollback()
+            self.log.debug('Unable to cache value %s: %s', key, e)
+    
+    def discard_generations_before(self, generation):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_cache WHERE generation<%s", (generation,))
+        db.commit()
+
+
+class FileSystemCacheBackend(Component):
+    """Stores each cached value in a file, one directory per cache 
+    generation. All processes on hosts which share the environment directory
+    (or the configured cache directory) share the cache."""
+    
+    implements(IBlogCacheBackend)
+    
+    cache_dir = Option('wiki-blog', 'cache_dir', 'cache/wiki-blog',
+        """Directory used by the `FileSystemCacheBackend` (relative paths are 
+        relative to the environment directory).""")
+    
+    def _path(self, *parts):
+        path = os.path.join(self.env.path, self.cache_dir)
+        return os.path.join(path, *[str(part) for part in parts])
+    
+    # IBlogCacheBackend
+    def get(self, key, generation):
+        try:
+            cache_file = open(self._path(generation, key[:2], key), 'rb')
+        except IOError:
+            return None
+        try:
+            expires = cache_file.readline()
+            if int(expires) < time.time():
+                return None
+            return cache_file.read().decode('utf-8')
+        finally:
+            cache_file.close()
+    
+    def set(self, key, generation, value, timeout):
+        directory = self._path(generation, key[:2])
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # readers must never see partially written files
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            cache_file = os.fdopen(fd, 'wb')
+            try:
+                cache_file.write('%d\n' % (time.time() + timeout))
+                cache_file.write(value.encode('utf-8'))
+            finally:
+                cache_file.close()
+            os.rename(temp_path, os.path.join(directory, key))
+        except (IOError, OSError), e:
+            self.log.debug('Unable to cache value %s: %s', key, e)
+    
+    def discard_generations_before(self, generation):
+        try:
+            names = os.listdir(self._path())
+        except OSError:
+            return
+        for name in names:
+            if name.isdigit() and int(name) < generation:
+                shutil.rmtree(self._path(name), ignore_errors=True)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+from trac.core import Component, implements, TracError
+from trac.db import Column, DatabaseManager, Index, Table
+from trac.env import IEnvironmentSetupParticipant
+from tractags.db import TagSetup
+
+
+__all__ = ['BlogEnvironmentSetup']
+
+
+# Every table is tagged with the schema version which introduced it so that 
+# upgrades only need to create the missing tables.
+schema_version = 8
+schema = [
+    (1, Table('blog_render_cache', key=('name', 'version', 'fragment', 'settings'))[
+        Column('name'),
+        Column('version', type='int'),
+        Column('fragment'),
+        Column('settings'),
+        Column('html'),
+    ]),
+    (2, Table('blog_post', key='name')[
+        Column('name'),
+        Column('version', type='int'),
+        Column('title'),
+        Column('created', type='int64'),
+        Column('modified', type='int64'),
+        Column('author'),
+        Column('tags'),
+        Index(['created']),
+    ]),
+    (3, Table('blog_archive', key=('year', 'month'))[
+        Column('year', type='int'),
+        Column('month', type='int'),
+        Column('posts', type='int'),
+    ]),
+    (4, Table('blog_cache', key='id')[
+        Column('id'),
+        Column('generation', type='int'),
+        Column('expires', type='int64'),
+        Column('value'),
+    ]),
+    (5, Table('blog_search', key=('token', 'name'))[
+        Column('token'),
+        Column('name'),
+        Column('weight', type='int'),
+        Index(['name']),
+    ]),
+    (6, Table('blog_related', key=('name', 'related'))[
+        Column('name'),
+        Column('related'),
+        Column('score', type='int'),
+        Index(['related']),
+    ]),
+    (7, Table('blog_tag', key='tag')[
+        Column('tag'),
+        Column('posts', type='int'),
+    ]),
+    (8, Table('blog_page_with_posts', key='name')[
+        Column('name'),
+        Column('version', type='int'),
+    ]),
+]
+
+
+class BlogEnvironmentSetup(Component):
+    """Creates and upgrades the database tables used by the blog."""
+    
+    implements(IEnvironmentSetupParticipant)
+    
+    # IEnvironmentSetupParticipant
+    def environment_created(self):
+        # TracTags creates the 'tags' table only during the first upgrade so
+        # there is nothing to index yet.
+        db = self.env.get_db_cnx()
+        self._create_tables(db, 0)
+        db.commit()
+    
+    def environment_needs_upgrade(self, db):
+        current_version = self._schema_version(db)
+        if current_version > schema_version:
+            raise TracError('The database schema of TracWikiBlog is newer than '
+                            'the installed plugin (version %d).' % current_version)
+        return current_version < schema_version
+    
+    def upgrade_environment(self, db):
+        current_version = self._schema_version(db)
+        self._create_tables(db, current_version)
+        if self._has_tags_table(db):
+            self._rebuild_indexes(db, current_version)
+        else:
+            self.log.warning('TracTags did not create its tables yet, run '
+                             '"trac-admin <env> blog rebuild-index" after '
+                             'upgrading TracTags.')
+        self.log.info('Upgraded TracWikiBlog database schema from version %d to %d',
+                      current_version, schema_version)
+    
+    def _create_tables(self, db, current_version):
+        cursor = db.cursor()
+        connector, ignored = DatabaseManager(self.env)._get_connector()
+        for version, table in schema:
+            if version <= current_version:
+                continue
+            for statement in connector.to_sql(table):
+                cursor.execute(statement)
+        if current_version < 4:
+            cursor.execute("INSERT INTO system (name, value) VALUES (%s, %s)",
+                           ('wiki_blog_cache_generation', '0'))
+        if current_version == 0:
+            cursor.execute("INSERT INTO system (name, value) VALUES (%s, %s)",
+                           ('wiki_blog_version', str(schema_version)))
+        else:
+            cursor.execute("UPDATE system SET value=%s WHERE name=%s",
+                           (str(schema_version), 'wiki_blog_version'))
+    
+    def _has_tags_table(self, db):
+        # TracTags reports version 2 for installations which have the 'tags'
+        # table but did not register their schema version yet.
+        return TagSetup(self.env).get_schema_version(db) >= 2
+    
+    def _rebuild_indexes(self, db, current_version):
+        from trac_wiki_blog.index import BlogPostIndex
+        from trac_wiki_blog.related import RelatedPostsIndex
+        from trac_wiki_blog.search import BlogSearchIndex
+        if current_version < 2:
+            BlogPostIndex(self.env).rebuild(db)
+        else:
+            if current_version < 3:
+                BlogPostIndex(self.env).rebuild_archive(db)
+            if current_version < 5:
+                BlogSearchIndex(self.env).rebuild(db)
+            if current_version < 6:
+                RelatedPostsIndex(self.env).rebuild(db)
+            if current_version < 7:
+                BlogPostIndex(self.env).rebuild_tag_counts(db)
+    
+    def _schema_version(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name=%s", ('wiki_blog_version',))
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        return int(row[0])
+
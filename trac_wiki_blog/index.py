@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+from trac.core import Component, implements
+from trac.perm import PermissionSystem
+from trac.util.translation import _
+from trac.web.api import IRequestFilter
+from trac.wiki.api import IWikiChangeListener
+from tractags.query import InvalidQuery, Query, QueryNode
+
+from trac_wiki_blog.model import BlogPost
+from trac_wiki_blog.stats import get_db_cnx
+from trac_wiki_blog.util import from_utimestamp, month_range, parse_post, \
+    to_utimestamp
+
+
+__all__ = ['BlogPostIndex']
+
+
+class BlogPostIndex(Component):
+    """Keeps the blog_post table in sync with all wiki pages tagged 'blog'.
+    
+    The table contains everything which is needed to list blog posts (title,
+    creation/modification time, author and tags) so listings can be sorted and
+    paginated by the database without querying the tag system or loading the
+    page text.
+    
+    Additionally the number of posts per month (by creation date in UTC) is 
+    kept in the blog_archive table and the number of posts per tag in the 
+    blog_tag table so the archive and the tag cloud can be displayed without
+    counting all posts again.
+    
+    TracTags stores the tags entered in the wiki editor after the wiki change
+    listeners were called or, if only the tags were changed, without any wiki
+    change at all. Therefore the page is indexed again when the wiki form 
+    redirects after a successful save (or rename)."""
+    
+    implements(IRequestFilter, IWikiChangeListener)
+    
+    blog_tag = 'blog'
+    
+    # permission policies which grant WIKI_VIEW for all pages or for none
+    realm_wide_policies = ('DefaultPermissionPolicy', 'LegacyAttachmentPolicy')
+    
+    def post_names(self, db=None, query=None):
+        """Return the names of all blog posts, newest first. If a tag query 
+        (TracTags syntax, e.g. 'release-notes or -draft') is given, only 
+        posts matching the query are returned."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        condition, args = self._query_condition(query)
+        cursor.execute("SELECT name FROM blog_post WHERE %s "
+                       "ORDER BY created DESC, name" % condition, args)
+        return [row[0] for row in cursor]
+    
+    def visible_post_names(self, req, db=None, query=None):
+        """Return the names of all blog posts (matching the tag query) the 
+        user may see, newest first."""
+        return self._visible_names(req, self.post_names(db, query))
+    
+    def post_names_between(self, start, end, db=None):
+        """Return the names of all blog posts created in the given interval
+        (including start, excluding end), newest first."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM blog_post WHERE created >= %s AND "
+                       "created < %s ORDER BY created DESC, name",
+                       (to_utimestamp(start), to_utimestamp(end)))
+        return [row[0] for row in cursor]
+    
+    def visible_post_names_between(self, req, start, end, db=None):
+        """Return the names of all blog posts created in the given interval
+        which the user may see, newest first."""
+        return self._visible_names(req, self.post_names_between(start, end, db))
+    
+    def iter_visible_posts(self, req, offset=0, limit=None, db=None):
+        """Yield (page name, last modification) for all blog posts the user 
+        may see, oldest first. The rows are fetched from the cursor while 
+        iterating so even huge blogs don't need to fit into memory."""
+        page_specific = self._has_page_specific_permissions()
+        if not page_specific and not self._may_view_all_posts(req):
+            return
+        if page_specific and 'TAGS_VIEW' not in req.perm:
+            return
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        query = "SELECT name, modified FROM blog_post ORDER BY created, name"
+        if limit is not None:
+            query += " LIMIT %d OFFSET %d" % (limit, offset)
+        cursor.execute(query)
+        for name, modified in cursor:
+            if page_specific and 'WIKI_VIEW' not in req.perm('wiki', name):
+                continue
+            yield name, from_utimestamp(modified)
+    
+    def archive(self, db=None):
+        """Return (year, month, number of posts) for every month which 
+        contains blog posts, newest month first."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT year, month, posts FROM blog_archive "
+                       "ORDER BY year DESC, month DESC")
+        return [tuple(row) for row in cursor]
+    
+    def visible_archive(self, req, db=None):
+        """Like archive() but only counts the posts the user may see."""
+        if not self._has_page_specific_permissions():
+            if not self._may_view_all_posts(req):
+                return []
+            return self.archive(db)
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT name, created FROM blog_post")
+        names_and_dates = cursor.fetchall()
+        visible_names = set(self._visible_names(req, [row[0] for row 
+                                                      in names_and_dates]))
+        posts_per_month = {}
+        for name, created in names_and_dates:
+            if name in visible_names:
+                month = self._month(created)
+                posts_per_month[month] = posts_per_month.get(month, 0) + 1
+        return sorted([(year, month, number_of_posts) for (year, month), 
+                       number_of_posts in posts_per_month.items()], reverse=True)
+    
+    def tag_counts(self, db=None):
+        """Return (tag, number of posts) for all tags of blog posts (besides
+        the 'blog' tag), sorted by tag."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT tag, posts FROM blog_tag ORDER BY tag")
+        return [tuple(row) for row in cursor]
+    
+    def visible_tag_counts(self, req, db=None):
+        """Like tag_counts() but only counts the posts the user may see."""
+        if not self._has_page_specific_permissions():
+            if not self._may_view_all_posts(req):
+                return []
+            return self.tag_counts(db)
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT name, tags FROM blog_post")
+        names_and_tags = cursor.fetchall()
+        visible_names = set(self._visible_names(req, [row[0] for row 
+                                                      in names_and_tags]))
+        posts_per_tag = {}
+        for name, tags in names_and_tags:
+            if name in visible_names:
+                for tag in tags.split():
+                    posts_per_tag[tag] = posts_per_tag.get(tag, 0) + 1
+        posts_per_tag.pop(self.blog_tag, None)
+        return sorted(posts_per_tag.items())
+    
+    def _query_condition(self, query):
+        """Translate a TracTags query into an SQL condition for blog_post so
+        the database can select the matching posts. Returns the condition 
+        and its arguments."""
+        args = []
+        def condition(node):
+            if node is None or node.type in (None, QueryNode.NULL):
+                return '1=1'
+            if node.type == QueryNode.TERM:
+                args.extend(['wiki', node.value])
+                return "name IN (SELECT name FROM tags WHERE tagspace=%s AND tag=%s)"
+            if node.type == QueryNode.NOT:
+                return 'NOT (%s)' % condition(node.left)
+            if node.type in (QueryNode.AND, QueryNode.OR):
+                operator = (node.type == QueryNode.AND) and 'AND' or 'OR'
+                return '(%s %s %s)' % (condition(node.left), operator, 
+                                       condition(node.right))
+            if node.type == QueryNode.ATTR and node.left.value == 'realm':
+                # blog posts are always wiki pages
+                if node.right.type == QueryNode.TERM:
+                    return (node.right.value == 'wiki') and '1=1' or '1=0'
+            raise InvalidQuery(_('Unsupported tag query "%(query)s"', query=query))
+        if not query:
+            return '1=1', args
+        return condition(Query(query)), args
+    
+    def _visible_names(self, req, pagenames):
+        """Return the given page names without the pages the user must not 
+        see. With the default permission policies only a single check for the
+        whole wiki is needed, other policies are asked for every page."""
+        if not self._has_page_specific_permissions():
+            if not self._may_view_all_posts(req):
+                return []
+            return list(pagenames)
+        # same permissions as required by TracTags for tagged wiki pages
+        if 'TAGS_VIEW' not in req.perm:
+            return []
+        return [name for name in pagenames
+                if 'WIKI_VIEW' in req.perm('wiki', name)]
+    
+    def _may_view_all_posts(self, req):
+        return ('TAGS_VIEW' in req.perm) and ('WIKI_VIEW' in req.perm('wiki'))
+    
+    def _has_page_specific_permissions(self):
+        for policy in PermissionSystem(self.env).policies:
+            if policy.__class__.__name__ not in self.realm_wide_policies:
+                return True
+        return False
+    
+    def newest_change(self, db=None):
+        """Return the time of the latest modification of any blog post (None 
+        if there are no posts) and the number of posts."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT MAX(modified), COUNT(*) FROM blog_post")
+        last_modified, number_of_posts = cursor.fetchone()
+        if last_modified is not None:
+            last_modified = from_utimestamp(last_modified)
+        return last_modified, number_of_posts
+    
+    def get_posts(self, pagenames, db=None):
+        """Return a BlogPost for each of the given page names (same order 
+        as the names, unknown pages are skipped). The page texts are not 
+        loaded until they are needed."""
+        pagenames = list(pagenames)
+        if len(pagenames) == 0:
+            return []
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        placeholders = ', '.join(['%s'] * len(pagenames))
+        cursor.execute("SELECT name, version, title, created, modified, author, "
+                       "tags FROM blog_post WHERE name IN (%s)" % placeholders,
+                       pagenames)
+        posts = {}
+        for name, version, title, created, modified, author, tags in cursor:
+            posts[name] = BlogPost(self.env, name, version, title,
+                                   from_utimestamp(created), 
+                                   from_utimestamp(modified), author, tags.split())
+        return [posts[name] for name in pagenames if name in posts]
+    
+    def update(self, name, db=None):
+        """Add, refresh or remove the index entry for the given page depending
+        on whether it exists and is tagged as blog post. Return True if the 
+        page is or was a blog post."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT created, tags FROM blog_post WHERE name=%s", (name,))
+        changed_months = set()
+        changed_tags = set()
+        for created, tags in cursor:
+            changed_months.add(self._month(created))
+            changed_tags.update(tags.split())
+        cursor.execute("DELETE FROM blog_post WHERE name=%s", (name,))
+        row = self._index_row(cursor, name)
+        if row is not None:
+            cursor.execute("INSERT INTO blog_post (name, version, title, created, "
+                           "modified, author, tags) VALUES (%s, %s, %s, %s, %s, "
+                           "%s, %s)", row)
+            changed_months.add(self._month(row[3]))
+            changed_tags.update(row[6].split())
+        for year, month in changed_months:
+            self._count_posts_in_month(cursor, year, month)
+        for tag in changed_tags:
+            self._count_posts_with_tag(cursor, tag)
+        from trac_wiki_blog.related import RelatedPostsIndex
+        from trac_wiki_blog.search import BlogSearchIndex
+        BlogSearchIndex(self.env).update(name, db)
+        RelatedPostsIndex(self.env).update(name, db)
+        if handle_ta:
+            db.commit()
+        return len(changed_months) > 0
+    
+    def rebuild(self, db=None):
+        """Recreate the index for all blog posts from scratch."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        for pagenames in self.tagged_page_names(db=db):
+            for name in pagenames:
+                self.update(name, db)
+        self.remove_stale_entries(db)
+        self.rebuild_archive(db)
+        self.rebuild_tag_counts(db)
+        if handle_ta:
+            db.commit()
+    
+    def rebuild_archive(self, db=None):
+        """Recount the posts for all months from the indexed blog posts."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_archive")
+        # Jump from month to month using the index on 'created' so months 
+        # without posts are skipped without looking at every single post.
+        cursor.execute("SELECT MIN(created) FROM blog_post")
+        created = cursor.fetchone()[0]
+        while created is not None:
+            year, month = self._month(created)
+            self._count_posts_in_month(cursor, year, month)
+            next_month = to_utimestamp(month_range(year, month)[1])
+            cursor.execute("SELECT MIN(created) FROM blog_post WHERE "
+                           "created >= %s", (next_month,))
+            created = cursor.fetchone()[0]
+        if handle_ta:
+            db.commit()
+    
+    def rebuild_tag_counts(self, db=None):
+        """Recount the posts for all tags of the indexed blog posts."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_tag")
+        cursor.execute("INSERT INTO blog_tag (tag, posts) SELECT tag, COUNT(*) "
+                       "FROM tags WHERE tagspace=%s AND tag!=%s AND name IN "
+                       "(SELECT name FROM blog_post) GROUP BY tag", 
+                       ('wiki', self.blog_tag))
+        if handle_ta:
+            db.commit()
+    
+    def archive_is_up_to_date(self, db=None):
+        """Return True if the archive matches the indexed blog posts."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT created FROM blog_post")
+        expected_archive = {}
+        for row in cursor:
+            month = self._month(row[0])
+            expected_archive[month] = expected_archive.get(month, 0) + 1
+        archive = dict([((year, month), posts) for year, month, posts 
+                        in self.archive(db)])
+        return archive == expected_archive
+    
+    def _month(self, created):
+        created = from_utimestamp(created)
+        return created.year, created.month
+    
+    def _count_posts_in_month(self, cursor, year, month):
+        start, end = month_range(year, month)
+        cursor.execute("SELECT COUNT(*) FROM blog_post WHERE created >= %s "
+                       "AND created < %s", (to_utimestamp(start), to_utimestamp(end)))
+        number_of_posts = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM blog_archive WHERE year=%s AND month=%s",
+                       (year, month))
+        if number_of_posts > 0:
+            cursor.execute("INSERT INTO blog_archive (year, month, posts) "
+                           "VALUES (%s, %s, %s)", (year, month, number_of_posts))
+    
+    def _count_posts_with_tag(self, cursor, tag):
+        if tag == self.blog_tag:
+            return
+        cursor.execute("SELECT COUNT(*) FROM tags WHERE tagspace=%s AND tag=%s "
+                       "AND name IN (SELECT name FROM blog_post)", ('wiki', tag))
+        number_of_posts = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM blog_tag WHERE tag=%s", (tag,))
+        if number_of_posts > 0:
+            cursor.execute("INSERT INTO blog_tag (tag, posts) VALUES (%s, %s)",
+                           (tag, number_of_posts))
+    
+    def tagged_page_names(self, batch_size=100, db=None):
+        """Yield the names of all wiki pages tagged as blog post (sorted by 
+        name) in lists of at most batch_size names."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        last_name = ''
+        while True:
+            cursor.execute("SELECT DISTINCT name FROM tags WHERE tagspace=%s "
+                           "AND tag=%s AND name > %s ORDER BY name LIMIT %s",
+                           ('wiki', self.blog_tag, last_name, batch_size))
+            pagenames = [row[0] for row in cursor]
+            if len(pagenames) == 0:
+                return
+            yield pagenames
+            last_name = pagenames[-1]
+    
+    def remove_stale_entries(self, db=None):
+        """Remove all entries of pages which are not tagged as blog post 
+        anymore. Returns the number of removed entries."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        stale_entries = "FROM blog_post WHERE name NOT IN (SELECT name FROM " \
+                        "tags WHERE tagspace=%s AND tag=%s)"
+        cursor.execute("SELECT created, tags " + stale_entries, ('wiki', self.blog_tag))
+        changed_months = set()
+        changed_tags = set()
+        for created, tags in cursor:
+            changed_months.add(self._month(created))
+            changed_tags.update(tags.split())
+        cursor.execute("DELETE " + stale_entries, ('wiki', self.blog_tag))
+        removed_entries = cursor.rowcount
+        for year, month in changed_months:
+            self._count_posts_in_month(cursor, year, month)
+        for tag in changed_tags:
+            self._count_posts_with_tag(cursor, tag)
+        from trac_wiki_blog.related import RelatedPostsIndex
+        from trac_wiki_blog.search import BlogSearchIndex
+        BlogSearchIndex(self.env).remove_stale_entries(db)
+        RelatedPostsIndex(self.env).remove_stale_entries(db)
+        if handle_ta:
+            db.commit()
+        return removed_entries
+    
+    def is_up_to_date(self, name, db=None):
+        """Return True if the index entry of the given page matches the 
+        current state of the page and its tags."""
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT name, version, title, created, modified, author, "
+                       "tags FROM blog_post WHERE name=%s", (name,))
+        indexed_row = cursor.fetchone()
+        if indexed_row is not None:
+            indexed_row = tuple(indexed_row)
+        return indexed_row == self._index_row(cursor, name)
+    
+    def _index_row(self, cursor, name):
+        cursor.execute("SELECT tag FROM tags WHERE tagspace=%s AND name=%s",
+                       ('wiki', name))
+        tags = sorted([row[0] for row in cursor])
+        if self.blog_tag not in tags:
+            return None
+        cursor.execute("SELECT version, time, text FROM wiki WHERE name=%s "
+                       "ORDER BY version DESC LIMIT 1", (name,))
+        latest_version = cursor.fetchone()
+        if latest_version is None:
+            return None
+        version, modified, text = latest_version
+        cursor.execute("SELECT time, author FROM wiki WHERE name=%s "
+                       "ORDER BY version LIMIT 1", (name,))
+        created, author = cursor.fetchone()
+        try:
+            title = parse_post(text)[0]
+        except ValueError:
+            title = None
+        return (name, version, title, created, modified, author, ' '.join(tags))
+    
+    # IRequestFilter
+    def pre_process_request(self, req, handler):
+        if req.method == 'POST' and req.path_info.startswith('/wiki/'):
+            req.add_redirect_listener(self._update_saved_page)
+        return handler
+    
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+    
+    def _update_saved_page(self, req, url, permanent):
+        from trac_wiki_blog.cache import BlogCache
+        pagenames = [req.args.get('page'), req.args.get('new_name')]
+        is_post = False
+        for name in filter(None, pagenames):
+            is_post = self.update(name) or is_post
+        if is_post:
+            BlogCache(self.env).invalidate()
+    
+    # IWikiChangeListener
+    def wiki_page_added(self, page):
+        self.update(page.name)
+    
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self.update(page.name)
+    
+    def wiki_page_deleted(self, page):
+        self.update(page.name)
+    
+    def wiki_page_version_deleted(self, page):
+        self.update(page.name)
+    
+    def wiki_page_renamed(self, page, old_name):
+        self.update(old_name)
+        self.update(page.name)
+
@@ -29,28 +29,48 @@
 # With ideas and initial code from John Hampton <pacopablo@pacopablo.com> and
 # his TracBlogPlugin (http://trac-hacks.org/wiki/TracBlogPlugin)
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 import re
+import time
 
 from genshi.builder import Markup, tag
+from genshi.core import escape
 from pkg_resources import resource_filename
-from trac.core import implements
+from trac.config import BoolOption, IntOption
+from trac.core import Component, implements, TracError
 from trac.mimeview.api import Context
 from trac.resource import Resource
-from trac.util.datefmt import format_datetime, pretty_timedelta, to_datetime
+from trac.util.datefmt import format_datetime, pretty_timedelta, to_datetime, \
+    utc
 from trac.util.translation import _
-from trac.web.chrome import add_stylesheet, Chrome, ITemplateProvider
-from trac.wiki.formatter import HtmlFormatter
+from trac.web.api import IRequestFilter
+from trac.web.chrome import add_link, add_stylesheet, Chrome, ITemplateProvider
+from trac.wiki.api import IWikiChangeListener, parse_args
+from trac.wiki.formatter import format_to_oneliner, HtmlFormatter
 from trac.wiki.macros import WikiMacroBase
 
 
-from trac_wiki_blog.util import content_from_wiki_markup, \
-    creation_date_of_page, get_wiki_pagename, load_pages_with_tags, \
-    sort_by_creation_date, title_from_wiki_markup
+from trac_wiki_blog.cache import BlogCache, RenderCache
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.related import RelatedPostsIndex
+from trac_wiki_blog.stats import BlogStatistics, get_db_cnx, null_recorder
+from trac_wiki_blog.util import excerpt_from_wiki_markup, from_utimestamp, \
+    get_wiki_pagename, LRUCache, month_range, paginate_page_list, \
+    parallel_map, parse_post, send_not_modified_if_unchanged, send_validators
 
 
-__all__ = ['ShowPostsMacro']
+__all__ = ['ArchiveListMacro', 'BlogTagCloudMacro', 'MoreMacro', 
+           'RelatedPostsMacro', 'ShowPostsConditionalGet', 'ShowPostsMacro']
 
 
+_anchor_re = re.compile(r'[^\w:.-]+', re.UNICODE)
+# The title may contain commas, it only ends before another macro argument.
+_title_re = re.compile(r'(?:^|,)\s*title=(.*?)(?=,\s*(?:per_page|page|excerpt|'
+                       r'tags|query)\s*=|$)', re.DOTALL)
+
 def now():
     return to_datetime(None)
 
@@ -59,86 +79,296 @@ class ShowPostsMacro(WikiMacroBase):
     """Macro to display a list of tagged blog posts, sorted by creation time.
     
     Example:
-       ![[ShowPosts(title=Blog Posts)]]
+       ![[ShowPosts(title=Blog Posts, per_page=5)]]
     
     The macro gets an optional parameter "title" so you can customize the title
-    above the list of blog posts.
+    above the list of blog posts (commas are part of the title up to the next
+    argument). "per_page" controls how many posts are shown
+    at once (default: `[wiki-blog] posts_per_page`), "page" selects the page 
+    which is displayed initially. Visitors can browse older posts with the 
+    "blog_page" query parameter.
+    
+    Use "excerpt" to display only the beginning of each post:
+     * `excerpt=more` shows everything up to a `[[more]]` line
+     * `excerpt=paragraphs:2` shows the first two paragraphs
+     * `excerpt=characters:500` shows roughly the first 500 characters
+    A `[[more]]` line always takes precedence over the other limits.
+    
+    "tags" restricts the list to posts which have all of the given 
+    (space-separated) tags, "query" accepts any TracTags query:
+       ![[ShowPosts(tags=release-notes)]]
+       ![[ShowPosts(query=release-notes or security -draft)]]
+    
+    The complete HTML of displayed post lists is cached (see `[wiki-blog] 
+    output_cache` and `cache_backend`) so popular blog pages are not 
+    rendered again for every visitor.
     """
     
-    implements(ITemplateProvider)
+    implements(ITemplateProvider, IWikiChangeListener)
+    
+    posts_per_page = IntOption('wiki-blog', 'posts_per_page', 10,
+        """Number of blog posts displayed on one page by the `ShowPosts` 
+        macro.""")
+    
+    render_workers = IntOption('wiki-blog', 'render_workers', 1,
+        """Number of threads which render the posts displayed by `ShowPosts`
+        concurrently (posts from the render cache are not rendered again). 
+        The default (1) renders all posts in the request thread.""")
+    
+    output_cache = BoolOption('wiki-blog', 'output_cache', True,
+        """Cache the complete output of `ShowPosts` (per macro arguments, page
+        and permissions) in the configured `cache_backend`.""")
+    
+    # number of parsed posts (title and content) kept in memory
+    parse_cache_size = 200
+    
+    # cached output is rendered again after this many seconds so relative
+    # dates like "written 5 hours ago" do not become stale (same period as
+    # ShowPostsConditionalGet uses for its validators)
+    output_cache_period = 600
+    
+    def __init__(self):
+        self._parsed_posts = LRUCache(self.parse_cache_size)
+        self._parsed_generation = None
     
     # WikiMacroBase
     def expand_macro(self, formatter, macro_name, argument_string):
         req = formatter.req
-        pages = sort_by_creation_date(load_pages_with_tags(self.env, req, "blog"))
+        ShowPostsConditionalGet(self.env).register(formatter)
+        ignored, kwargs = parse_args(argument_string or '')
+        per_page = self._positive_int(kwargs.get('per_page'), self.posts_per_page)
+        page_number = self._positive_int(kwargs.get('page'), 1)
+        page_number = self._positive_int(req.args.get('blog_page'), page_number)
+        excerpt = self._excerpt(kwargs)
+        recorder = BlogStatistics(self.env).recorder(req, 'ShowPosts')
+        
+        add_stylesheet(req, 'blog/css/blog.css')
+        add_link(req, 'alternate', req.href.blog('feed'), _('Blog Posts'),
+                 'application/atom+xml')
+        store = None
+        cache = BlogCache(self.env)
+        generation = recorder.measure('cache_generation', cache.generation)
+        self.use_cache_generation(generation)
+        if self.output_cache:
+            cache_key = recorder.measure('output_cache', self._output_key, req,
+                                         argument_string, per_page, page_number)
+            html = recorder.measure('output_cache', cache.get, cache_key, generation)
+            if html is not None:
+                recorder.finish()
+                return Markup(html)
+            store = lambda html: cache.set(cache_key, generation, html, 
+                                           self.output_cache_period)
+        # Trac 0.12's wiki formatter converts the macro output to a string 
+        # right away so a lazy stream would not be streamed to the client 
+        # anyway and would hide the serialization from the statistics.
+        html = self._render_posts(req, self._title(argument_string), kwargs,
+                                  per_page, page_number, excerpt, recorder)
+        if store is not None:
+            store(html)
+        recorder.finish()
+        return Markup(html)
+    
+    def use_cache_generation(self, generation):
+        """Drop all parsed posts if the blog cache generation changed since 
+        they were parsed (e.g. because another process changed a page)."""
+        if generation != self._parsed_generation:
+            self._parsed_posts.clear()
+            self._parsed_generation = generation
+    
+    def _output_key(self, req, argument_string, per_page, page_number):
+        """Return the key for the output cache: Besides the macro arguments 
+        the HTML depends on the permissions (and settings) of the user and the
+        page it is displayed on (pagination links). Changed posts start a new
+        cache generation."""
+        cache_settings = RenderCache(self.env).settings_key(req)
+        return ('ShowPosts', argument_string, per_page, page_number, 
+                req.path_info, cache_settings)
+    
+    def _render_posts(self, req, title, kwargs, per_page, page_number, excerpt,
+                      recorder):
+        index = BlogPostIndex(self.env)
+        pagenames = recorder.measure('post_names', index.visible_post_names, req,
+                                     query=self._tag_query(kwargs))
+        start_index = (page_number - 1) * per_page
+        # only the posts in the current window are loaded from the database,
+        # their texts only if they are not in the render cache
+        posts = recorder.measure('get_posts', index.get_posts,
+            paginate_page_list(pagenames, start_index, per_page))
         
         # TODO: make the name of the template configurable in trac.ini
         # TODO: add creation date, modified date (if different than creation) and tags
-        processed_pages = []
-        for page in pages:
-            processed_pages.append(self._process_page(req, page))
+        cache_settings = RenderCache(self.env).settings_key(req)
+        process_post = lambda post: self._process_page(req, post, post.created,
+                                                cache_settings, excerpt, recorder)
+        if self.render_workers > 1:
+            processed_posts = parallel_map(process_post, posts, self.render_workers)
+        else:
+            # the template renders each post as soon as it is needed
+            processed_posts = (process_post(post) for post in posts)
         
-        add_stylesheet(req, 'blog/css/blog.css')
         parameters = dict(
-            blog_heading = _(self._title(argument_string)),
+            blog_heading = _(title),
             read_post_title = _("Read Post"),
-            pages = processed_pages
+            newer_posts_title = _("Newer Posts"),
+            older_posts_title = _("Older Posts"),
+            pages = processed_posts,
+            pagination = self._pagination(req, page_number, per_page, len(pagenames)),
         )
-        return self._render_template(req, 'show_posts_macro.html', parameters)
+        return recorder.measure('render_template', self._render_template, req,
+                                'show_posts_macro.html', parameters)
     
     def _title(self, argument_string):
-        if argument_string in (None, ''):
+        match = _title_re.search(argument_string or '')
+        title = match and match.group(1).strip() or ''
+        if title == '':
             return u'Blog Posts'
-        assert argument_string.startswith('title=')
-        return argument_string.split('title=', 1)[1].strip()
+        return title
     
-    def _wiki_to_html(self, req, resource, wikitext):
+    def _excerpt(self, kwargs):
+        """Return the keyword arguments for excerpt_from_wiki_markup() or None
+        if complete posts should be shown."""
+        excerpt = kwargs.get('excerpt', '').strip()
+        if excerpt == '':
+            return None
+        if excerpt == 'more':
+            return {}
+        mode, number = (excerpt.split(':', 1) + [''])[:2]
+        if mode in ('paragraphs', 'characters') and number.strip().isdigit():
+            return {mode: int(number)}
+        raise TracError(_('Invalid excerpt "%(excerpt)s", use "more", '
+                          '"paragraphs:<number>" or "characters:<number>".',
+                          excerpt=excerpt))
+    
+    def _tag_query(self, kwargs):
+        """Return the TracTags query which combines the "tags" and "query" 
+        arguments (None if neither was given)."""
+        terms = []
+        query = kwargs.get('query', '').strip()
+        if query:
+            terms.append('(%s)' % query)
+        for tag_name in kwargs.get('tags', '').split():
+            terms.append('"%s"' % tag_name.replace('\\', '\\\\').replace('"', '\\"'))
+        return ' '.join(terms) or None
+    
+    def _positive_int(self, value, default):
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            return default
+        if number < 1:
+            return default
+        return number
+    
+    def _pagination(self, req, page_number, per_page, number_of_posts):
+        def page_href(number):
+            return req.href(req.path_info, blog_page=number)
+        
+        has_newer_posts = (page_number > 1)
+        has_older_posts = (page_number * per_page < number_of_posts)
+        return dict(
+            newer_href = has_newer_posts and page_href(page_number - 1) or None,
+            older_href = has_older_posts and page_href(page_number + 1) or None,
+        )
+    
+    def _context(self, req, resource):
         context = Context(resource, href=req.href, perm=req.perm)
         # HtmlFormatter relies on the .req even though that's not always present
         # in a Context. Seems like a known dark spot in Trac's API. Check 
         # comments in trac.mimeview.api.Context.__call__()
         context.req = req
+        return context
+    
+    def _wiki_to_html(self, req, resource, wikitext):
+        context = self._context(req, resource)
         return HtmlFormatter(self.env, context, wikitext).generate()
     
-    def _blogpost_to_html(self, req, page):
-        return self._wiki_to_html(req, page.resource, content_from_wiki_markup(page.text))
+    def _parse(self, page):
+        """Return title and content of the given page. The result is cached 
+        so title and content are not parsed separately. Pages without a 
+        heading have no title (None), all of their text is the content."""
+        # A page which is deleted and created again (maybe by another Trac 
+        # process) starts with version 1 again so the time of the version is
+        # needed to identify the text.
+        version = (page.version, page.time)
+        cached_version, parsed_post = self._parsed_posts.get(page.name, (None, None))
+        if cached_version != version:
+            try:
+                parsed_post = parse_post(page.text)
+            except ValueError:
+                parsed_post = (None, page.text)
+            self._parsed_posts.set(page.name, (version, parsed_post))
+        return parsed_post
     
-    def _wikitext_title(self, page):
-        return u'= %s =' % title_from_wiki_markup(page.text)
+    def _blogpost_to_html(self, req, page, excerpt=None):
+        wikitext = self._parse(page)[1]
+        if excerpt is not None:
+            wikitext = excerpt_from_wiki_markup(wikitext, **excerpt)
+        return self._wiki_to_html(req, page.resource, wikitext)
     
-    def _extract_root_tag(self, tag, html):
-        pattern = '(<%(tag)s[^>]*>)(.*)(</%(tag)s>)' % dict(tag=tag)
-        match = re.search(pattern, html)
-        assert match is not None
-        return match.groups()
+    def _heading_id(self, title_html):
+        # same ids as the wiki formatter generates for headings
+        plain_title = Markup(title_html).striptags().stripentities()
+        heading_id = _anchor_re.sub('', plain_title)
+        if not heading_id or heading_id[0].isdigit() or heading_id[0] in '.-':
+            heading_id = 'a' + heading_id
+        return heading_id
     
     def _blogpost_title_html(self, req, page):
-        title_html = self._wiki_to_html(req, page.resource, self._wikitext_title(page))
-        title_groups = self._extract_root_tag('h1', title_html)
-        
-        link_html = self._wiki_to_html(req, page.resource, '[wiki:"%s"]' % page.resource.id)
-        link_groups = self._extract_root_tag('a', link_html)
-        
-        opening_tags = title_groups[0] + link_groups[0]
-        core_title_html = title_groups[1]
-        closing_tags = link_groups[2] + title_groups[2]
-        final_html = opening_tags + core_title_html + closing_tags
-        return Markup(final_html)
-    
-    def _process_page(self, req, page):
-        post_content = content_from_wiki_markup(page.text)
-        creation_date = creation_date_of_page(page)
-        
+        context = self._context(req, page.resource)
+        title = self._parse(page)[0]
+        if title is None:
+            title_html = escape(page.name)
+        else:
+            title_html = format_to_oneliner(self.env, context, title)
+        link = tag.a(title_html, class_='wiki', href=req.href.wiki(page.name))
+        return tag.h1(link, id=self._heading_id(title_html))
+    
+    def _cached_html(self, page, fragment, cache_settings, render, recorder, phase):
+        cache = RenderCache(self.env)
+        html = recorder.measure('render_cache', cache.get, page.name, 
+                                page.version, fragment, cache_settings)
+        if html is None:
+            html = unicode(recorder.measure(phase, render))
+            cache.set(page.name, page.version, fragment, cache_settings, html)
+        return Markup(html)
+    
+    def render_post(self, req, page, cache_settings, excerpt=None, recorder=None):
+        """Return the HTML for title and content (or just the excerpt) of the
+        given page. Both are taken from the render cache if possible."""
+        return (self.render_title(req, page, cache_settings, recorder),
+                self.render_content(req, page, cache_settings, excerpt, recorder))
+    
+    def render_title(self, req, page, cache_settings, recorder=None):
+        title_html = lambda: self._blogpost_title_html(req, page)
+        return self._cached_html(page, 'title', cache_settings, title_html,
+                                 recorder or null_recorder, 'title_to_html')
+    
+    def render_content(self, req, page, cache_settings, excerpt=None, recorder=None):
+        content_html = lambda: self._blogpost_to_html(req, page, excerpt)
+        if excerpt is None:
+            fragment = 'body'
+        else:
+            fragment = 'excerpt:' + ','.join(['%s=%d' % item for item 
+                                              in sorted(excerpt.items())])
+        return self._cached_html(page, fragment, cache_settings, content_html,
+                                 recorder or null_recorder, 'wiki_to_html')
+    
+    def _process_page(self, req, page, creation_date, cache_settings, excerpt=None,
+                      recorder=None):
+        title, content = self.render_post(req, page, cache_settings, excerpt, 
+                                          recorder)
         return dict(
-            title = self._blogpost_title_html(req, page),
+            title = title,
             url = req.href.wiki(page.name),
             creation_date = format_datetime(creation_date),
             delta = pretty_timedelta(creation_date, now()),
-            content=self._blogpost_to_html(req, page),
+            content = content,
         )
     
     def _render_template(self, req, template, attributes):
-        return Chrome(self.env).render_template(req, template, attributes, None)
+        stream = Chrome(self.env).render_template(req, template, attributes, 
+                                                  None, fragment=True)
+        return stream.render('xhtml', encoding=None)
         
     # --------------------------------------------------------------------------
     # ITemplateProvider
@@ -147,5 +377,297 @@ class ShowPostsMacro(WikiMacroBase):
     
     def get_htdocs_dirs(self):
         return [('blog', resource_filename(__name__, 'htdocs'))]
+    
+    # IWikiChangeListener
+    # Parsed posts of changed pages are never used again.
+    def wiki_page_added(self, page):
+        self._parsed_posts.pop(page.name)
+    
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self._parsed_posts.pop(page.name)
+    
+    def wiki_page_deleted(self, page):
+        self._parsed_posts.pop(page.name)
+    
+    def wiki_page_version_deleted(self, page):
+        self._parsed_posts.pop(page.name)
+    
+    def wiki_page_renamed(self, page, old_name):
+        self._parsed_posts.pop(old_name)
+        self._parsed_posts.pop(page.name)
+
+
+
+
+class MoreMacro(WikiMacroBase):
+    """Marks the end of the excerpt which `ShowPosts(excerpt=more)` displays 
+    for a blog post. The marker itself is invisible.
+    
+    Example:
+       ![[more]]
+    """
+    
+    # WikiMacroBase
+    def get_macros(self):
+        yield 'more'
+    
+    def expand_macro(self, formatter, macro_name, argument_string):
+        return ''
+
+
+class ArchiveListMacro(WikiMacroBase):
+    """Displays the number of blog posts per month, each month linking to 
+    the archive of that month.
+    
+    Example:
+       ![[ArchiveList]]
+    
+    The numbers are read from the precomputed archive unless a permission 
+    policy may hide single posts. Then only the visible posts are counted.
+    """
+    
+    # WikiMacroBase
+    def expand_macro(self, formatter, macro_name, argument_string):
+        req = formatter.req
+        archive = BlogPostIndex(self.env).visible_archive(req)
+        if not archive:
+            return ''
+        add_stylesheet(req, 'blog/css/blog.css')
+        items = []
+        for year, month, number_of_posts in archive:
+            label = format_datetime(month_range(year, month)[0], '%B %Y', utc)
+            link = tag.a(label, href=req.href.blog('archive', year, '%02d' % month))
+            items.append(tag.li(link, ' (%d)' % number_of_posts))
+        return tag.ul(items, class_='blog_archive_list')
+
+
+class RelatedPostsMacro(WikiMacroBase):
+    """Lists the blog posts which share the most tags with the current post
+    (the 'blog' tag is not counted).
+    
+    Example:
+       ![[RelatedPosts(5)]]
+    
+    The optional argument is the maximum number of posts (default: 5), "page"
+    selects another post than the current page:
+       ![[RelatedPosts(3, page=2011/05/release-notes)]]
+    """
+    
+    default_count = 5
+    
+    # WikiMacroBase
+    def expand_macro(self, formatter, macro_name, argument_string):
+        req = formatter.req
+        args, kwargs = parse_args(argument_string or '')
+        pagename = kwargs.get('page', '').strip() or self._current_page(formatter)
+        if not pagename:
+            return ''
+        count = args and args[0] or kwargs.get('count')
+        count = ShowPostsMacro(self.env)._positive_int(count, self.default_count)
+        posts = RelatedPostsIndex(self.env).related_posts(req, pagename, count)
+        if not posts:
+            return ''
+        add_stylesheet(req, 'blog/css/blog.css')
+        items = [tag.li(tag.a(post.title or post.name, href=req.href.wiki(post.name)))
+                 for post in posts]
+        return tag.ul(items, class_='blog_related_posts')
+    
+    def _current_page(self, formatter):
+        resource = getattr(getattr(formatter, 'context', None), 'resource', None)
+        if resource is None or resource.realm != 'wiki':
+            return None
+        return resource.id
+
+
+class BlogTagCloudMacro(WikiMacroBase):
+    """Displays the tags of all blog posts (besides the 'blog' tag), more 
+    frequently used tags in a bigger font. Each tag links to the tag page.
+    
+    Example:
+       ![[BlogTagCloud]]
+    
+    The optional argument limits the cloud to the most frequently used tags:
+       ![[BlogTagCloud(20)]]
+    
+    The numbers are read from the precomputed tag counts unless a permission
+    policy may hide single posts. Then only the visible posts are counted.
+    """
+    
+    min_font_size = 100
+    max_font_size = 200
+    
+    # WikiMacroBase
+    def expand_macro(self, formatter, macro_name, argument_string):
+        req = formatter.req
+        args, kwargs = parse_args(argument_string or '')
+        tag_counts = BlogPostIndex(self.env).visible_tag_counts(req)
+        if not tag_counts:
+            return ''
+        limit = args and args[0] or kwargs.get('limit')
+        limit = ShowPostsMacro(self.env)._positive_int(limit, None)
+        if limit is not None:
+            most_used = sorted(tag_counts, key=lambda item: (-item[1], item[0]))
+            tag_counts = sorted(most_used[:limit])
+        add_stylesheet(req, 'blog/css/blog.css')
+        smallest = min([posts for name, posts in tag_counts])
+        largest = max([posts for name, posts in tag_counts])
+        items = []
+        for name, posts in tag_counts:
+            title = posts == 1 and _('1 post') or _('%(count)s posts', count=posts)
+            link = tag.a(name, href=req.href.tags(name), title=title,
+                         style='font-size: %d%%' % self._font_size(posts, smallest, largest))
+            items.append(tag.li(link))
+        return tag.ul(items, class_='blog_tag_cloud')
+    
+    def _font_size(self, posts, smallest, largest):
+        if largest == smallest:
+            return self.min_font_size
+        spread = self.max_font_size - self.min_font_size
+        return self.min_font_size + spread * (posts - smallest) // (largest - smallest)
 
 
+class ShowPostsConditionalGet(Component):
+    """Adds validators (ETag/Last-Modified) to wiki pages which embed 
+    ShowPosts so browsers and proxies can revalidate them cheaply.
+    
+    ShowPosts registers the page it is rendered on in the database (so all 
+    Trac processes know about it). Later requests for the same page version 
+    are answered with "304 Not Modified" before the page is rendered if 
+    neither the blog posts nor the user's permissions changed. As relative 
+    dates like "written 5 hours ago" must not become stale, the validators 
+    also change every ten minutes."""
+    
+    implements(IRequestFilter, IWikiChangeListener)
+    
+    enabled = BoolOption('wiki-blog', 'conditional_get', False,
+        """Answer conditional requests for wiki pages containing `ShowPosts` 
+        with "304 Not Modified" if no post changed. Only enable this if these
+        pages contain no other dynamic content (e.g. ticket queries).""")
+    
+    period = 600
+    
+    def register(self, formatter):
+        """Remember that the page which is currently viewed embeds ShowPosts 
+        and add the validators to the response (if not done already). 
+        
+        The page is already being rendered so this never answers the request
+        itself, only the next request for the page can be short-circuited."""
+        if not self.enabled:
+            return
+        req = formatter.req
+        pagename = self._viewed_page(req)
+        resource = getattr(getattr(formatter, 'context', None), 'resource', None)
+        if pagename is None or resource is None:
+            return
+        if resource.realm != 'wiki' or resource.id != pagename:
+            return
+        version, page_modified = self._latest_version(pagename)
+        if version is None:
+            return
+        if self._registered_version(pagename) != version:
+            self._set_registered_version(pagename, version)
+        if not req.environ.get('trac_wiki_blog.validators_sent'):
+            send_validators(req, *self._validators(req, pagename, version, 
+                                                   page_modified))
+            req.environ['trac_wiki_blog.validators_sent'] = True
+    
+    # IRequestFilter
+    def pre_process_request(self, req, handler):
+        pagename = self._viewed_page(req)
+        if not self.enabled or pagename is None:
+            return handler
+        version, page_modified = self._latest_version(pagename)
+        if version is None or self._registered_version(pagename) != version:
+            return handler
+        etag, last_modified = self._validators(req, pagename, version, page_modified)
+        req.environ['trac_wiki_blog.validators_sent'] = True
+        send_not_modified_if_unchanged(req, etag, last_modified)
+        return handler
+    
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+    
+    # IWikiChangeListener
+    # A page which is deleted and created again starts with version 1 again,
+    # that version must not be mistaken for the old page with ShowPosts.
+    def wiki_page_added(self, page):
+        pass
+    
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        pass
+    
+    def wiki_page_deleted(self, page):
+        self._unregister(page.name)
+    
+    def wiki_page_version_deleted(self, page):
+        self._unregister(page.name)
+    
+    def wiki_page_renamed(self, page, old_name):
+        self._unregister(old_name)
+        self._unregister(page.name)
+    
+    def _viewed_page(self, req):
+        if req.method not in ('GET', 'HEAD'):
+            return None
+        if req.args.get('action', 'view') != 'view' or req.args.get('version'):
+            return None
+        if req.path_info in ('', '/'):
+            if self.config.get('trac', 'default_handler') != 'WikiModule':
+                return None
+            return 'WikiStart'
+        match = re.match(r'/wiki(?:/(.+))?$', req.path_info)
+        if match is None:
+            return None
+        return match.group(1) or 'WikiStart'
+    
+    def _latest_version(self, pagename):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT version, time FROM wiki WHERE name=%s "
+                       "ORDER BY version DESC LIMIT 1", (pagename,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, None
+        return row[0], from_utimestamp(row[1])
+    
+    def _registered_version(self, pagename):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT version FROM blog_page_with_posts WHERE name=%s",
+                       (pagename,))
+        row = cursor.fetchone()
+        return row and row[0] or None
+    
+    def _set_registered_version(self, pagename, version):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        try:
+            cursor.execute("DELETE FROM blog_page_with_posts WHERE name=%s", 
+                           (pagename,))
+            cursor.execute("INSERT INTO blog_page_with_posts (name, version) "
+                           "VALUES (%s, %s)", (pagename, version))
+            db.commit()
+        except Exception, e:
+            # Most likely another process registered the page concurrently,
+            # the next request registers it again if necessary.
+            db.rollback()
+            self.log.debug('Unable to register page %s: %s', pagename, e)
+    
+    def _unregister(self, pagename):
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_page_with_posts WHERE name=%s", 
+                       (pagename,))
+        db.commit()
+    
+    def _validators(self, req, pagename, version, page_modified):
+        """Return ETag and Last-Modified for the given page version."""
+        posts_modified, number_of_posts = BlogPostIndex(self.env).newest_change()
+        period_start = int(time.time() / self.period) * self.period
+        etag = md5(repr([pagename, version, posts_modified, number_of_posts,
+                         period_start, req.authname, req.query_string,
+                         RenderCache(self.env).settings_key(req),
+                         BlogCache(self.env).generation()])).hexdigest()
+        last_modified = max([date for date in (page_modified, posts_modified,
+                            to_datetime(period_start, utc)) if date is not None])
+        return etag, last_modified
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+from trac.resource import Resource
+
+from trac_wiki_blog.stats import get_db_cnx
+
+
+__all__ = ['BlogPost']
+
+
+class BlogPost(object):
+    """Indexed data of a single blog post. 
+    
+    Listings may contain many posts so only the data from the blog index is
+    kept in memory. The page text is loaded (once) when it is first accessed,
+    e.g. because the post is not in the render cache. BlogPost provides the 
+    attributes of WikiPage which are needed to render a post."""
+    
+    __slots__ = ('env', 'name', 'version', 'title', 'created', 'modified', 
+                 'author', 'tags', '_text')
+    
+    def __init__(self, env, name, version, title, created, modified, author, 
+                 tags, text=None):
+        self.env = env
+        self.name = name
+        self.version = version
+        self.title = title
+        self.created = created
+        self.modified = modified
+        self.author = author
+        self.tags = tags
+        self._text = text
+    
+    def __repr__(self):
+        return '<BlogPost %r@%d>' % (self.name, self.version)
+    
+    @property
+    def text(self):
+        if self._text is None:
+            db = get_db_cnx(self.env)
+            cursor = db.cursor()
+            cursor.execute("SELECT text FROM wiki WHERE name=%s AND version=%s",
+                           (self.name, self.version))
+            row = cursor.fetchone()
+            self._text = (row is not None) and row[0] or u''
+        return self._text
+    
+    @property
+    def time(self):
+        return self.modified
+    
+    @property
+    def resource(self):
+        return Resource('wiki', self.name)
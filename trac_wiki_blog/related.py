@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+from trac.core import Component
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.stats import get_db_cnx
+
+
+__all__ = ['RelatedPostsIndex']
+
+
+class RelatedPostsIndex(Component):
+    """Keeps the number of shared tags for every pair of blog posts in the 
+    blog_related table (only pairs which share at least one tag besides 
+    'blog') so the related posts can be read with a single query.
+    
+    The scores of a post are recomputed by BlogPostIndex whenever the post
+    (or its tags) changes."""
+    
+    def related_posts(self, req, name, limit):
+        """Return the visible blog posts which share the most tags with the 
+        given post (newer posts first if they share the same number of 
+        tags)."""
+        index = BlogPostIndex(self.env)
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        query = "SELECT r.related FROM blog_related r, blog_post p " \
+                "WHERE r.name=%s AND p.name=r.related " \
+                "ORDER BY r.score DESC, p.created DESC"
+        # a policy might hide single posts so all related posts are needed
+        if index._has_page_specific_permissions():
+            cursor.execute(query, (name,))
+        else:
+            cursor.execute(query + " LIMIT %s", (name, limit))
+        pagenames = index._visible_names(req, [row[0] for row in cursor])
+        return index.get_posts(pagenames[:limit], db)
+    
+    def update(self, name, db):
+        """Recompute the scores between the given post and all other posts."""
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_related WHERE name=%s OR related=%s", 
+                       (name, name))
+        cursor.execute("SELECT tags FROM blog_post WHERE name=%s", (name,))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        tags = [tag for tag in row[0].split() if tag != BlogPostIndex.blog_tag]
+        if len(tags) == 0:
+            return
+        placeholders = ', '.join(['%s'] * len(tags))
+        cursor.execute("SELECT name, COUNT(*) FROM tags WHERE tagspace=%%s AND "
+                       "tag IN (%s) AND name!=%%s AND name IN (SELECT name FROM "
+                       "blog_post) GROUP BY name" % placeholders, 
+                       ['wiki'] + tags + [name])
+        scores = cursor.fetchall()
+        rows = [(name, related, score) for related, score in scores] + \
+               [(related, name, score) for related, score in scores]
+        cursor.executemany("INSERT INTO blog_related (name, related, score) "
+                           "VALUES (%s, %s, %s)", rows)
+    
+    def rebuild(self, db=None):
+        """Recompute the scores for all posts in the blog index."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM blog_post")
+        for name in [row[0] for row in cursor.fetchall()]:
+            self.update(name, db)
+        if handle_ta:
+            db.commit()
+    
+    def remove_stale_entries(self, db):
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_related WHERE name NOT IN (SELECT "
+                       "name FROM blog_post) OR related NOT IN (SELECT name "
+                       "FROM blog_post)")
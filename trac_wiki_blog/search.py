@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+
+import re
+
+from trac.config import IntOption
+from trac.core import Component, implements
+from trac.search.api import ISearchSource, shorten_result
+from trac.util.translation import _
+
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.stats import get_db_cnx
+from trac_wiki_blog.util import parse_post
+
+
+__all__ = ['BlogSearchIndex']
+
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text, max_length=40):
+    """Return the lower-cased words of the given text (words with only one 
+    character are ignored)."""
+    return [token[:max_length] for token in _token_re.findall(text.lower()) 
+            if len(token) > 1]
+
+
+class BlogSearchIndex(Component):
+    """Full-text search for blog posts ("Blog posts" filter on the search 
+    page).
+    
+    The blog_search table maps every word in title and content of a post to
+    a weight (number of occurrences, words in the title count more). Searches
+    only look up the words from the query so they do not need to scan the 
+    text of all posts. The index is updated by BlogPostIndex whenever a post 
+    changes."""
+    
+    implements(ISearchSource)
+    
+    max_results = IntOption('wiki-blog', 'search_results', 50,
+        """Maximum number of (best matching) blog posts returned by the 
+        search.""")
+    
+    title_weight = 5
+    
+    def search(self, req, terms, limit=None, offset=0):
+        """Return the visible blog posts which contain all of the given terms,
+        the best matches first."""
+        tokens = set()
+        for term in terms:
+            tokens.update(tokenize(term))
+        if len(tokens) == 0:
+            return []
+        db = get_db_cnx(self.env)
+        cursor = db.cursor()
+        placeholders = ', '.join(['%s'] * len(tokens))
+        cursor.execute("SELECT name FROM blog_search WHERE token IN (%s) "
+                       "GROUP BY name HAVING COUNT(*)=%%s "
+                       "ORDER BY SUM(weight) DESC, name" % placeholders, 
+                       list(tokens) + [len(tokens)])
+        index = BlogPostIndex(self.env)
+        pagenames = index._visible_names(req, [row[0] for row in cursor])
+        if limit is not None:
+            pagenames = pagenames[offset:offset+limit]
+        else:
+            pagenames = pagenames[offset:]
+        return index.get_posts(pagenames, db)
+    
+    def update(self, name, db):
+        """Index the words of the given blog post (or remove it from the 
+        search index if it is not in the blog index anymore)."""
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_search WHERE name=%s", (name,))
+        cursor.execute("SELECT text FROM wiki WHERE name=%s AND version="
+                       "(SELECT version FROM blog_post WHERE name=%s)", 
+                       (name, name))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        weights = self._weights(row[0])
+        cursor.executemany("INSERT INTO blog_search (token, name, weight) "
+                           "VALUES (%s, %s, %s)", 
+                           [(token, name, weight) for token, weight 
+                            in weights.items()])
+    
+    def rebuild(self, db=None):
+        """Recreate the search index for all posts in the blog index."""
+        handle_ta = db is None
+        db = db or get_db_cnx(self.env)
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_search")
+        cursor.execute("SELECT name FROM blog_post")
+        for name in [row[0] for row in cursor.fetchall()]:
+            self.update(name, db)
+        if handle_ta:
+            db.commit()
+    
+    def remove_stale_entries(self, db):
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM blog_search WHERE name NOT IN "
+                       "(SELECT name FROM blog_post)")
+    
+    def _weights(self, text):
+        try:
+            title, content = parse_post(text)
+        except ValueError:
+            title, content = u'', text
+        weights = {}
+        for token in tokenize(title):
+            weights[token] = weights.get(token, 0) + self.title_weight
+        for token in tokenize(content):
+            weights[token] = weights.get(token, 0) + 1
+        return weights
+    
+    # ISearchSource
+    def get_search_filters(self, req):
+        if 'WIKI_VIEW' in req.perm and 'TAGS_VIEW' in req.perm:
+            yield ('blog', _('Blog posts'), False)
+    
+    def get_search_results(self, req, terms, filters):
+        # Trac orders all results by date, the best matches are selected here
+        if 'blog' not in filters:
+            return
+        for post in self.search(req, terms, limit=self.max_results):
+            yield (req.href.wiki(post.name), post.title or post.name, 
+                   post.created, post.author, shorten_result(post.text, terms))
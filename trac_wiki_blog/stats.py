@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License
+# 
+# Copyright (c) 2011 Felix Schwarz <felix.schwarz@oss.schwarz.eu>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Authors:
+#   - Felix Schwarz
+
+import logging
+import threading
+import time
+
+from pkg_resources import resource_filename
+from trac.admin import IAdminPanelProvider
+from trac.config import BoolOption
+from trac.core import Component, implements
+from trac.util.translation import _
+from trac.web.chrome import ITemplateProvider
+
+
+__all__ = ['BlogStatistics', 'get_db_cnx']
+
+
+class QueryCounter(object):
+    """Number of statements executed with CountingConnections."""
+    
+    def __init__(self):
+        self.queries = 0
+
+
+class ThreadQueryCounter(QueryCounter, threading.local):
+    """Counts the statements of every thread separately while the thread 
+    measures something."""
+    
+    def __init__(self):
+        QueryCounter.__init__(self)
+        self.measurements_running = 0
+
+_query_counter = ThreadQueryCounter()
+
+
+class CountingCursor(object):
+    
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+    
+    def execute(self, *args, **kwargs):
+        self._counter.queries += 1
+        return self._cursor.execute(*args, **kwargs)
+    
+    def executemany(self, *args, **kwargs):
+        self._counter.queries += 1
+        return self._cursor.executemany(*args, **kwargs)
+    
+    def __iter__(self):
+        return iter(self._cursor)
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingConnection(object):
+    
+    def __init__(self, connection, counter):
+        self._connection = connection
+        self._counter = counter
+    
+    def cursor(self):
+        return CountingCursor(self._connection.cursor(), self._counter)
+    
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def get_db_cnx(env):
+    """Return a database connection of the environment. While the current 
+    thread measures a phase, the queries executed with the connection are 
+    counted (queries of Trac and other plugins which do not get the connection
+    passed are not)."""
+    db = env.get_db_cnx()
+    if _query_counter.measurements_running == 0:
+        return db
+    return CountingConnection(db, _query_counter)
+
+
+class Recorder(object):
+    """Collects number of calls, time and database queries for the phases of
+    a single macro call or request."""
+    
+    def __init__(self, statistics, req, name):
+        self.statistics = statistics
+        self.path = getattr(req, 'path_info', None)
+        self.name = name
+        # phase -> [calls, seconds, queries]
+        self.phases = {}
+        self._lock = threading.Lock()
+        self._start = time.time()
+    
+    def measure(self, phase, function, *args, **kwargs):
+        """Call the function and record its duration and the number of 
+        queries it executed (phases may be nested)."""
+        _query_counter.measurements_running += 1
+        queries_before = _query_counter.queries
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._add(phase, time.time() - start, 
+                      _query_counter.queries - queries_before)
+            _query_counter.measurements_running -= 1
+    
+    def _add(self, phase, seconds, queries):
+        self._lock.acquire()
+        try:
+            calls, total_seconds, total_queries = self.phases.get(phase, (0, 0, 0))
+            self.phases[phase] = [calls + 1, total_seconds + seconds, 
+                                  total_queries + queries]
+        finally:
+            self._lock.release()
+    
+    def finish(self):
+        """Log the collected numbers and add them to the overall statistics."""
+        self.statistics._finish(self, time.time() - self._start)
+
+
+class NullRecorder(object):
+    """Used if statistics are disabled so that measuring costs nothing."""
+    
+    def measure(self, phase, function, *args, **kwargs):
+        return function(*args, **kwargs)
+    
+    def finish(self):
+        pass
+
+null_recorder = NullRecorder()
+
+
+class BlogStatistics(Component):
+    """Measures how much time and how many database queries the blog needs 
+    for finding, formatting and rendering posts.
+    
+    If enabled in trac.ini, the numbers for each ShowPosts call (and each 
+    feed request) are written to the log at debug level. They are also summed
+    up and shown in the admin panel "Blog > Statistics"."""
+    
+    implements(IAdminPanelProvider, ITemplateProvider)
+    
+    enabled = BoolOption('wiki-blog', 'statistics', False,
+        """Collect timing and query statistics for the blog and show them in
+        the admin interface.""")
+    
+    def __init__(self):
+        # (name, phase) -> [calls, seconds, queries]
+        self._totals = {}
+        # name -> [number of measurements, seconds]
+        self._measurements = {}
+        self._lock = threading.Lock()
+    
+    def recorder(self, req, name):
+        """Return a Recorder for the given macro/handler (or a recorder which
+        does nothing if nobody is interested in the numbers)."""
+        if not self.enabled:
+            return null_recorder
+        return Recorder(self, req, name)
+    
+    def totals(self):
+        """Return the summed up statistics as a list of dicts (sorted by 
+        name and phase)."""
+        self._lock.acquire()
+        try:
+            statistics = []
+            for (name, phase), (calls, seconds, queries) in sorted(self._totals.items()):
+                measurements = self._measurements[name][0]
+                statistics.append(dict(name=name, phase=phase, calls=calls,
+                                       seconds=seconds, queries=queries,
+                                       measurements=measurements))
+            return statistics
+        finally:
+            self._lock.release()
+    
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._totals = {}
+            self._measurements = {}
+        finally:
+            self._lock.release()
+    
+    def _finish(self, recorder, seconds):
+        phases = sorted(recorder.phases.items())
+        if self.log.isEnabledFor(logging.DEBUG):
+            details = ', '.join(['%s: %dx %.1f ms %d queries' % (phase, calls, 
+                                 phase_seconds * 1000, queries) 
+                                 for phase, (calls, phase_seconds, queries) in phases])
+            self.log.debug('%s for %s took %.1f ms (%s)', recorder.name, 
+                           recorder.path, seconds * 1000, details)
+        self._lock.acquire()
+        try:
+            measurements, total_seconds = self._measurements.get(recorder.name, (0, 0))
+            self._measurements[recorder.name] = [measurements + 1, 
+                                                 total_seconds + seconds]
+            for phase, (calls, phase_seconds, queries) in phases:
+                key = (recorder.name, phase)
+                total_calls, total_seconds, total_queries = \
+                    self._totals.get(key, (0, 0, 0))
+                self._totals[key] = [total_calls + calls, total_seconds + 
+                                     phase_seconds, total_queries + queries]
+        finally:
+            self._lock.release()
+    
+    # IAdminPanelProvider
+    def get_admin_panels(self, req):
+        if self.enabled and 'TRAC_ADMIN' in req.perm:
+            yield ('blog', _('Blog'), 'stats', _('Statistics'))
+    
+    def render_admin_panel(self, req, category, page, path_info):
+        req.perm.require('TRAC_ADMIN')
+        if req.method == 'POST' and req.args.get('reset'):
+            self.reset()
+            req.redirect(req.href.admin(category, page))
+        return 'blog_admin_stats.html', {'statistics': self.totals()}
+    
+    # ITemplateProvider
+    def get_templates_dirs(self):
+        return [resource_filename(__name__, 'templates')]
+    
+    def get_htdocs_dirs(self):
+        return []
@@ -30,69 +30,398 @@
 # his TracBlogPlugin (http://trac-hacks.org/wiki/TracBlogPlugin)
 
 import datetime
+from email.utils import mktime_tz, parsedate_tz
+from Queue import Empty, Queue
 import re
+import sys
+import threading
 
+from trac.web.api import RequestDone
 from trac.wiki.model import WikiPage
-from trac.util.datefmt import utc
+from trac.util.datefmt import http_date, to_timestamp, utc
 
 from tractags.api import TagSystem
 
-__all__ = ['content_from_wiki_markup', 'title_from_wiki_markup',
+from trac_wiki_blog.stats import get_db_cnx
+
+
+__all__ = ['parse_post', 'content_from_wiki_markup', 'title_from_wiki_markup',
+           'excerpt_from_wiki_markup',
            'wiki_pagename_from_title', 'get_wiki_pagename', 
+           'unique_wiki_pagename',
            'sort_by_creation_date', 'creation_date_of_page', 
-           'load_pages_with_tags']
+           'creation_dates_of_pages', 'load_pages_with_tags',
+           'load_page_names_with_tags', 'load_pages', 'paginate_page_list',
+           'send_not_modified_if_unchanged', 'send_validators', 
+           'month_range', 'parallel_map',
+           'LRUCache']
+
+try:
+    from trac.util.datefmt import from_utimestamp, to_utimestamp
+except ImportError:
+    # Trac 0.11 stores timestamps as seconds since the epoch
+    def from_utimestamp(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp, utc)
+    
+    def to_utimestamp(date):
+        return to_timestamp(date)
 
 # ===============================================================
 # Parsing
 
-parsing_regex = re.compile(r'.*?^\s*=+\s+([^\n\r]+?)\s+=+\s*(.*?$.*)',
-                                re.MULTILINE|re.DOTALL)
+# start of a line which may contain the post title, e.g. "== Title =="
+heading_start_regex = re.compile(r'^[ \t\r\f\v]*=+[ \t\f\v]+', re.MULTILINE)
+heading_end_regex = re.compile(r'\s=')
+_whitespace = ' \t\n\r\f\v'
+
+def parse_post(wiki_markup):
+    """Return the title (the first heading) and the remaining content of a 
+    blog post. Raises ValueError if the markup contains no heading.
+    
+    Every line is looked at most twice so parsing takes linear time even for
+    huge pages without any heading."""
+    for match in heading_start_regex.finditer(wiki_markup):
+        line_end = wiki_markup.find('\n', match.end())
+        if line_end == -1:
+            line_end = len(wiki_markup)
+        line = wiki_markup[match.end():line_end]
+        # the title ends before the first '=' which follows a space (but the 
+        # title itself has at least one character)
+        end_match = heading_end_regex.search(line, 1)
+        if end_match is None:
+            continue
+        title_end = end_match.start()
+        while title_end > 1 and line[title_end - 1] in _whitespace:
+            title_end -= 1
+        content_start = end_match.end()
+        while content_start < len(line) and line[content_start] == '=':
+            content_start += 1
+        content = wiki_markup[match.end() + content_start:].lstrip(_whitespace)
+        return line[:title_end], content
+    raise ValueError('Markup is missing a title: %s' % wiki_markup[:200])
 
 def content_from_wiki_markup(wiki_markup):
-    match = parsing_regex.match(wiki_markup)
-    if match is None:
-        raise ValueError('Markup is missing a title: %s' % wiki_markup)
-    return match.group(2)
+    return parse_post(wiki_markup)[1]
 
 def title_from_wiki_markup(wiki_markup):
-    match = parsing_regex.match(wiki_markup)
-    if match is None:
-        raise ValueError('Markup is missing a title: %s' % wiki_markup)
-    return match.group(1)
+    return parse_post(wiki_markup)[0]
+
+more_marker_regex = re.compile(r'^[ \t]*\[\[more\]\][ \t]*$', re.MULTILINE)
+
+def excerpt_from_wiki_markup(wiki_markup, paragraphs=None, characters=None):
+    """Return the leading part of the wiki markup which should be displayed
+    in post listings.
+    
+    Everything before a '[[more]]' line is used if the markup contains one. 
+    Otherwise the markup is cut after the given number of paragraphs or 
+    (at a word boundary) after the given number of characters. Processor 
+    blocks ({{{ ... }}}) are never left open."""
+    match = more_marker_regex.search(wiki_markup)
+    if match is not None:
+        return wiki_markup[:match.start()].rstrip()
+    
+    excerpt_lines = []
+    length = 0
+    paragraph_count = 0
+    in_paragraph = False
+    open_blocks = 0
+    block_start = 0
+    for line in wiki_markup.splitlines():
+        stripped_line = line.strip()
+        if open_blocks == 0 and stripped_line == '':
+            if in_paragraph:
+                paragraph_count += 1
+                in_paragraph = False
+            if paragraphs is not None and paragraph_count >= paragraphs:
+                break
+        if characters is not None and length + len(line) > characters:
+            if open_blocks > 0:
+                # don't show half of a code block
+                del excerpt_lines[block_start:]
+                open_blocks = 0
+            elif not stripped_line.startswith('{{{'):
+                cut_line = line[:characters - length]
+                if ' ' in cut_line.strip():
+                    cut_line = cut_line.rsplit(' ', 1)[0]
+                excerpt_lines.append(cut_line.rstrip() + u' \u2026')
+            break
+        if stripped_line.startswith('{{{') and not stripped_line.endswith('}}}'):
+            if open_blocks == 0:
+                block_start = len(excerpt_lines)
+            open_blocks += 1
+        elif stripped_line == '}}}' and open_blocks > 0:
+            open_blocks -= 1
+        if stripped_line != '':
+            in_paragraph = True
+        excerpt_lines.append(line)
+        length += len(line) + 1
+    excerpt_lines.extend(['}}}'] * open_blocks)
+    return u'\n'.join(excerpt_lines).rstrip()
+
+# Everything besides letters, digits and underscores is replaced by a dash so
+# that page names never contain path separators, URL delimiters or wiki markup.
+_slug_separator_re = re.compile(r'[^\w]+', re.UNICODE)
+_max_slug_length = 60
 
 # TODO: Better name - this is not the wiki pagename but only the 'suffix' 
-def wiki_pagename_from_title(title):
-    basetitle = title.strip().lower()
-    basetitle = basetitle.replace(' ', '-')
-    return basetitle
+def wiki_pagename_from_title(title, max_length=_max_slug_length):
+    basetitle = _slug_separator_re.sub('-', title.strip().lower()).strip('-')
+    if len(basetitle) > max_length:
+        basetitle = basetitle[:max_length + 1]
+        # don't cut words if possible
+        if '-' in basetitle:
+            basetitle = basetitle.rsplit('-', 1)[0]
+        basetitle = basetitle[:max_length].rstrip('-')
+    return basetitle or u'post'
 
 
 def get_wiki_pagename(creation_date, title):
     basename = wiki_pagename_from_title(title)
     return '%d/%02d/%s' % (creation_date.year, creation_date.month, basename)
 
+def unique_wiki_pagename(env, pagename, db=None):
+    """Return the given page name if there is no such wiki page yet. 
+    Otherwise the lowest free number is appended ('-2', '-3', ...).
+    
+    The names of all these pages are fetched with a single prefix query. LIKE
+    may ignore the case so the names are checked again afterwards."""
+    db = db or get_db_cnx(env)
+    cursor = db.cursor()
+    prefix = pagename + '-'
+    # A range query would depend on the collation of the database, e.g. 
+    # locale collations in PostgreSQL ignore most punctuation.
+    cursor.execute("SELECT DISTINCT name FROM wiki WHERE name=%s OR name " + 
+                   db.like(), (pagename, db.like_escape(prefix) + '%'))
+    used_numbers = set()
+    for name, in cursor:
+        suffix = name[len(prefix):]
+        if name == pagename:
+            used_numbers.add(1)
+        elif name.startswith(prefix) and suffix.isdigit():
+            used_numbers.add(int(suffix))
+    number = 1
+    while number in used_numbers:
+        number += 1
+    if number == 1:
+        return pagename
+    return '%s-%d' % (pagename, number)
+
 # ===============================================================
 # Getting Pages
 
-def sort_by_creation_date(pagelist):
-    pagelist_with_dates = zip(map(creation_date_of_page, pagelist), pagelist)
-    pagelist_with_dates.sort()
-    pagelist_with_dates.reverse()
-    return [i[1] for i in pagelist_with_dates]
+def sort_by_creation_date(pagelist, creation_dates=None):
+    if len(pagelist) == 0:
+        return []
+    if creation_dates is None:
+        pagenames = [page.name for page in pagelist]
+        creation_dates = creation_dates_of_pages(pagelist[0].env, pagenames)
+    creation_date = lambda page: creation_dates.get(page.name)
+    return sorted(pagelist, key=creation_date, reverse=True)
 
 def creation_date_of_page(page):
     page = WikiPage(page.env, page.name, 1)
     return page.time
 
+# SQLite refuses statements with more than 999 bound parameters
+_max_names_per_query = 500
+
+def creation_dates_of_pages(env, pagenames, db=None):
+    """Return a dict which maps the given page names to their creation date.
+    
+    The dates for all pages are fetched with a single grouped query (for very
+    large lists the names are split up into a few chunks) instead of loading
+    the first version of every page separately."""
+    db = db or get_db_cnx(env)
+    cursor = db.cursor()
+    pagenames = list(pagenames)
+    creation_dates = {}
+    for i in range(0, len(pagenames), _max_names_per_query):
+        chunk = pagenames[i:i+_max_names_per_query]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute('SELECT name, MIN(time) FROM wiki WHERE name IN (%s) '
+                       'GROUP BY name' % placeholders, chunk)
+        for name, timestamp in cursor:
+            creation_dates[name] = from_utimestamp(timestamp)
+    return creation_dates
+
 def load_pages_with_tags(env, req, tags):
+    return load_pages(env, load_page_names_with_tags(env, req, tags))
+
+def load_page_names_with_tags(env, req, tags):
+    """Return the names of all wiki pages matching the tag query which the 
+    user may see without loading the actual pages."""
     tag_system = TagSystem(env)
-    pages = []
-    blog_resources = [i for i in tag_system.query(req, tags)]
-    for resource, ignored in blog_resources:
-        pages.append(WikiPage(env, resource))
-    return pages
+    return [resource.id for resource, ignored in tag_system.query(req, tags)
+            if 'WIKI_VIEW' in req.perm(resource)]
+
+def load_pages(env, pagenames):
+    return [WikiPage(env, name) for name in pagenames]
 
 def paginate_page_list(page_list, start_index=0, how_many=10):
-    return page_list[start_index:how_many]
+    return page_list[start_index:start_index+how_many]
 
+# ===============================================================
+# HTTP
+
+def send_validators(req, etag, last_modified=None):
+    """Add the validators (ETag/Last-Modified) to the response."""
+    req.send_header('ETag', '"%s"' % etag)
+    if last_modified is not None:
+        req.send_header('Last-Modified', http_date(last_modified))
+
+def send_not_modified_if_unchanged(req, etag, last_modified=None):
+    """Add the validators (ETag/Last-Modified) to the response. If the client
+    already has the current version, "304 Not Modified" is sent and the 
+    request processing stops (RequestDone)."""
+    send_validators(req, etag, last_modified)
+    if _client_has_current_version(req, '"%s"' % etag, last_modified):
+        req.send_response(304)
+        req.end_headers()
+        raise RequestDone
+
+def _client_has_current_version(req, etag, last_modified):
+    if_none_match = req.get_header('If-None-Match')
+    if if_none_match is not None:
+        client_etags = [tag.strip() for tag in if_none_match.split(',')]
+        return (etag in client_etags) or ('*' in client_etags)
+    if_modified_since = req.get_header('If-Modified-Since')
+    if (if_modified_since is None) or (last_modified is None):
+        return False
+    client_date = parsedate_tz(if_modified_since)
+    if client_date is None:
+        return False
+    return int(to_timestamp(last_modified)) <= mktime_tz(client_date)
+
+# ===============================================================
+# Archive
+
+def month_range(year, month=None):
+    """Return the first moment of the given month (or the whole year if no 
+    month is given) and the first moment after it as UTC datetimes."""
+    if month is None:
+        return (datetime.datetime(year, 1, 1, tzinfo=utc),
+                datetime.datetime(year + 1, 1, 1, tzinfo=utc))
+    start = datetime.datetime(year, month, 1, tzinfo=utc)
+    if month == 12:
+        return start, datetime.datetime(year + 1, 1, 1, tzinfo=utc)
+    return start, datetime.datetime(year, month + 1, 1, tzinfo=utc)
+
+# ===============================================================
+# Threading
+
+def parallel_map(function, items, workers):
+    """Return [function(item) for item in items] but call the function from
+    (at most) the given number of threads. The results are in the same order
+    as the items. If a call raises an exception, the remaining items are not
+    processed and the first exception is re-raised."""
+    items = list(items)
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [function(item) for item in items]
+    queue = Queue()
+    for index, item in enumerate(items):
+        queue.put((index, item))
+    results = [None] * len(items)
+    errors = []
+    def process_queue():
+        while not errors:
+            try:
+                index, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = function(item)
+            except:
+                errors.append(sys.exc_info())
+    threads = [threading.Thread(target=process_queue) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        exc_type, exc_value, traceback = errors[0]
+        raise exc_type, exc_value, traceback
+    return results
+
+# ===============================================================
+# Caching
 
+class LRUCache(object):
+    """Thread-safe mapping with a maximum size. If the cache is full, the 
+    least recently used entry is dropped."""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._clear()
+    
+    def _clear(self):
+        # key -> [previous link, next link, key, value] in a circular doubly 
+        # linked list, the root's next link is the least recently used entry
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+    
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self._lock.release()
+    
+    def set(self, key, value):
+        self._lock.acquire()
+        try:
+            link = self._links.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+            elif len(self._links) >= self.max_size:
+                oldest_link = self._root[1]
+                self._unlink(oldest_link)
+                del self._links[oldest_link[2]]
+            link = [None, None, key, value]
+            self._append(link)
+            self._links[key] = link
+        finally:
+            self._lock.release()
+    
+    def pop(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._links.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            return link[3]
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._clear()
+        finally:
+            self._lock.release()
+    
+    def __len__(self):
+        return len(self._links)
+    
+    def __contains__(self, key):
+        return key in self._links
+    
+    def _unlink(self, link):
+        previous_link, next_link = link[0], link[1]
+        previous_link[1] = next_link
+        next_link[0] = previous_link
+    
+    def _append(self, link):
+        root = self._root
+        last_link = root[0]
+        link[0], link[1] = last_link, root
+        last_link[1] = link
+        root[0] = link
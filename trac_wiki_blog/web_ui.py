@@ -30,36 +30,95 @@
 # his TracBlogPlugin (http://trac-hacks.org/wiki/TracBlogPlugin)
 
 import datetime
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 import re
+try:
+    from tempfile import SpooledTemporaryFile
+except ImportError:
+    # Python < 2.6 can only spool to disk
+    from tempfile import TemporaryFile
+    SpooledTemporaryFile = lambda max_size: TemporaryFile()
 
 from genshi.builder import tag
+from genshi.core import escape
 from pkg_resources import resource_filename
-from trac.core import implements
+from trac.config import IntOption
+from trac.core import Component, implements, TracError
+from trac.util.datefmt import format_datetime, utc
 from trac.util.translation import _
 from trac.web import IRequestHandler
-from trac.web.chrome import INavigationContributor, ITemplateProvider
+from trac.web.api import HTTPNotFound, RequestDone
+from trac.web.chrome import add_stylesheet, add_warning, Chrome, \
+    INavigationContributor, ITemplateProvider
+from trac.wiki.model import WikiPage
 from trac.wiki.web_ui import WikiModule
 from tractags.api import TagSystem
 from tractags.wiki import WikiTagInterface
 
-from trac_wiki_blog.util import get_wiki_pagename
+from trac_wiki_blog.cache import BlogCache, RenderCache
+from trac_wiki_blog.index import BlogPostIndex
+from trac_wiki_blog.macro import ShowPostsMacro
+from trac_wiki_blog.stats import BlogStatistics
+from trac_wiki_blog.util import get_wiki_pagename, month_range, \
+    LRUCache, send_not_modified_if_unchanged, unique_wiki_pagename
 
 
 
-__all__ = ['NewPostModule', 'NewPostTagInterface']
+__all__ = ['BlogArchiveModule', 'BlogFeedModule', 'BlogSitemapModule', 
+           'NewPostModule', 'NewPostTagInterface']
 
 
 _tag_split = re.compile('[,\s]+')
+_archive_path = re.compile(r'/blog/archive/(\d{4})(?:/(\d{1,2}))?/?$')
+_sitemap_path = re.compile(r'/blog/sitemap(?:-(\d+))?\.xml$')
+
+
+class PageNameTaken(Exception):
+    pass
+
+
+class NewBlogPostPage(WikiPage):
+    """A new blog post which gets its tags right after the page was saved.
+    
+    Saving the first version of the page fails if another post with the same
+    name was saved concurrently. Tagging the page only afterwards ensures that
+    the tags of the other post are never touched."""
+    
+    def __init__(self, env, name, req, tags):
+        WikiPage.__init__(self, env, name)
+        self.req = req
+        self.tags = tags
+    
+    def save(self, *args, **kwargs):
+        try:
+            WikiPage.save(self, *args, **kwargs)
+        except Exception:
+            # Only inserting the first version fails if the name was taken,
+            # errors of change listeners are raised after the insert.
+            if self.version > 0 or not WikiPage(self.env, self.name).exists:
+                raise
+            raise PageNameTaken(self.name)
+        TagSystem(self.env).add_tags(self.req, self.resource, self.tags)
+        # the page was not tagged yet when the change listeners were called
+        BlogPostIndex(self.env).update(self.name)
+        BlogCache(self.env).invalidate()
 
 
 class NewPostModule(WikiModule):
-    """Provides a convenient form to enter a new blog-post."""
+    """Provides a convenient form to enter a new blog-post.
+    
+    The page name is derived from the current month and the title. If there
+    is already a page with that name, a number is appended ('-2', '-3', ...).
+    """
     
     implements(INavigationContributor)
     
-    # TODO: add precautions so two posts at the day with the same name don't overwrite
-    # TODO: add more escapes to the wiki page name
-    # TODO: limit blog post user friendly name length
+    # how often a post is saved under a new name if other posts with the same
+    # title were saved concurrently
+    save_attempts = 5
     
     # Implementation IRequestHandler
     def match_request(self, req):
@@ -96,10 +155,23 @@ class NewPostModule(WikiModule):
         content = '= %s =\n\n%s' % (title, req.args.get('text', ''))
         req.args['text'] = content
         tags = ['blog'] + self._get_tags(req)
-        tag_system = TagSystem(self.env)
-        tag_system.add_tags(req, versioned_page.resource, tags)
-        result = super(NewPostModule, self)._do_save(req, versioned_page)
-        return result
+        pagename = versioned_page.name
+        # always derive new candidates from the slug so that retries never
+        # append a second number ('foo-2-2')
+        basename = get_wiki_pagename(datetime.date.today(), title)
+        for attempt in range(self.save_attempts):
+            page = NewBlogPostPage(self.env, pagename, req, tags)
+            if page.exists:
+                pagename = unique_wiki_pagename(self.env, basename)
+                continue
+            page.text = content
+            try:
+                return super(NewPostModule, self)._do_save(req, page)
+            except PageNameTaken:
+                self.log.debug('Blog post %s was created concurrently', pagename)
+                pagename = unique_wiki_pagename(self.env, basename)
+        raise TracError(_('Unable to find an unused page name for the blog '
+                          'post, please try again.'))
     
     def _render_editor(self, req, page, action='edit', has_collision=False):
         result = super(NewPostModule, self)._render_editor(req, 
@@ -116,7 +188,8 @@ class NewPostModule(WikiModule):
                 req.args['preview'] = True
                 wiki_page = '' # only rendered in window title
             else:
-                wiki_page = get_wiki_pagename(datetime.date.today(), title)
+                wiki_page = unique_wiki_pagename(self.env, 
+                    get_wiki_pagename(datetime.date.today(), title))
             req.args['page'] = wiki_page
         else:
             req.args['page'] = '_new_blog_template'
@@ -155,6 +228,247 @@ class NewPostModule(WikiModule):
 
 
 
+class BlogFeedModule(Component):
+    """Serves an Atom feed of the latest blog posts at /blog/feed."""
+    
+    implements(IRequestHandler)
+    
+    feed_entries = IntOption('wiki-blog', 'feed_entries', 20,
+        """Number of blog posts in the Atom feed.""")
+    
+    # number of serialized feeds kept in memory
+    feed_cache_size = 20
+    
+    def __init__(self):
+        # serialized feeds by base URL and settings key (which contains the 
+        # user if permission policies decide per page), each with its ETag
+        self._feeds = LRUCache(self.feed_cache_size)
+    
+    # IRequestHandler
+    def match_request(self, req):
+        return req.path_info == '/blog/feed'
+    
+    def process_request(self, req):
+        index = BlogPostIndex(self.env)
+        cache_settings = RenderCache(self.env).settings_key(req)
+        last_modified, number_of_posts = index.newest_change()
+        # all cached feeds are outdated once the blog cache is invalidated
+        generation = BlogCache(self.env).generation()
+        ShowPostsMacro(self.env).use_cache_generation(generation)
+        # the feed contains absolute URLs which depend on the requested host
+        base_url = req.abs_href()
+        etag = md5(repr([base_url, cache_settings, last_modified, 
+                         number_of_posts, self.feed_entries, generation])).hexdigest()
+        send_not_modified_if_unchanged(req, etag, last_modified)
+        
+        feed_key = (base_url, cache_settings)
+        cached_etag, xml = self._feeds.get(feed_key, (None, None))
+        if cached_etag != etag:
+            xml = self._render_feed(req, cache_settings, last_modified)
+            self._feeds.set(feed_key, (etag, xml))
+        req.send(xml, 'application/atom+xml')
+    
+    def _render_feed(self, req, cache_settings, last_modified):
+        recorder = BlogStatistics(self.env).recorder(req, 'BlogFeed')
+        index = BlogPostIndex(self.env)
+        pagenames = recorder.measure('post_names', index.visible_post_names, 
+                                     req)[:self.feed_entries]
+        macro = ShowPostsMacro(self.env)
+        entries = []
+        for post in recorder.measure('get_posts', index.get_posts, pagenames):
+            content = macro.render_content(req, post, cache_settings, 
+                                           recorder=recorder)
+            entries.append(dict(
+                title = post.title or post.name,
+                url = req.abs_href.wiki(post.name),
+                published = self._atom_date(post.created),
+                updated = self._atom_date(post.modified),
+                author = post.author,
+                content = unicode(content),
+            ))
+        data = dict(
+            feed_title = _('%(project)s: Blog Posts', project=self.env.project_name),
+            feed_url = req.abs_href.blog('feed'),
+            base_url = req.abs_href() + '/',
+            updated = self._atom_date(last_modified or datetime.datetime.now(utc)),
+            entries = entries,
+        )
+        feed = recorder.measure('render_template', 
+                                Chrome(self.env).render_template, req, 
+                                'blog_feed.xml', data, 'application/atom+xml')
+        recorder.finish()
+        return feed
+    
+    def _atom_date(self, date):
+        return date.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class BlogSitemapModule(Component):
+    """Serves a sitemap of all blog posts for search engine crawlers at 
+    /blog/sitemap.xml.
+    
+    A sitemap may contain at most 50,000 URLs so bigger blogs get a sitemap 
+    index instead which links to /blog/sitemap-1.xml, /blog/sitemap-2.xml, ...
+    The entries are read once from the blog post index and spooled to a 
+    temporary file (which stays in memory while it is small) so that the 
+    Content-Length always matches the body even if posts change meanwhile."""
+    
+    implements(IRequestHandler)
+    
+    max_urls = 50000
+    chunk_size = 500
+    # bytes of the sitemap kept in memory before spooling to disk
+    spool_size = 1024 * 1024
+    
+    # IRequestHandler
+    def match_request(self, req):
+        match = _sitemap_path.match(req.path_info)
+        if match is None:
+            return False
+        req.args['sitemap'] = match.group(1) and int(match.group(1))
+        return True
+    
+    def process_request(self, req):
+        index = BlogPostIndex(self.env)
+        last_modified, number_of_posts = index.newest_change()
+        number_of_sitemaps = max(1, (number_of_posts + self.max_urls - 1) // self.max_urls)
+        sitemap = req.args['sitemap']
+        if sitemap is not None and not (1 <= sitemap <= number_of_sitemaps):
+            raise HTTPNotFound(_('No sitemap %(number)d', number=sitemap))
+        # the sitemap contains absolute URLs which depend on the requested host
+        etag = md5(repr([req.abs_href(), RenderCache(self.env).settings_key(req), 
+                         last_modified, number_of_posts, sitemap, 
+                         self.max_urls])).hexdigest()
+        send_not_modified_if_unchanged(req, etag, last_modified)
+        
+        if sitemap is None and number_of_sitemaps > 1:
+            self._send_chunks(req, self._sitemap_index, number_of_sitemaps, 
+                              last_modified)
+        elif sitemap is None:
+            self._send_chunks(req, self._url_set, 0, None)
+        else:
+            offset = (sitemap - 1) * self.max_urls
+            self._send_chunks(req, self._url_set, offset, self.max_urls)
+    
+    def _send_chunks(self, req, generate, *args):
+        # Trac 0.12 needs the Content-Length before the body is written. 
+        # Generating the chunks again could return different posts.
+        body = SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            content_length = 0
+            for chunk in generate(req, *args):
+                body.write(chunk)
+                content_length += len(chunk)
+            req.send_response(200)
+            req.send_header('Content-Type', 'application/xml;charset=utf-8')
+            req.send_header('Content-Length', content_length)
+            req.end_headers()
+            if req.method != 'HEAD':
+                body.seek(0)
+                for chunk in iter(lambda: body.read(self.spool_size), ''):
+                    req.write(chunk)
+        finally:
+            body.close()
+        raise RequestDone
+    
+    def _sitemap_index(self, req, number_of_sitemaps, last_modified):
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n' \
+              '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        entries = []
+        for number in range(1, number_of_sitemaps + 1):
+            url = req.abs_href.blog('sitemap-%d.xml' % number)
+            entries.append(self._entry('sitemap', url, last_modified))
+            if len(entries) == self.chunk_size:
+                yield ''.join(entries)
+                entries = []
+        yield ''.join(entries) + '</sitemapindex>\n'
+    
+    def _url_set(self, req, offset, limit):
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n' \
+              '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        entries = []
+        for name, modified in BlogPostIndex(self.env).iter_visible_posts(req, offset, limit):
+            entries.append(self._entry('url', req.abs_href.wiki(name), modified))
+            if len(entries) == self.chunk_size:
+                yield ''.join(entries)
+                entries = []
+        yield ''.join(entries) + '</urlset>\n'
+    
+    def _entry(self, element, url, modified):
+        lastmod = modified.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        entry = u'<%s><loc>%s</loc><lastmod>%s</lastmod></%s>\n' % \
+            (element, escape(url), lastmod, element)
+        return entry.encode('utf-8')
+
+
+class BlogArchiveModule(Component):
+    """Lists all blog posts written in a year (/blog/archive/2011) or in a 
+    month (/blog/archive/2011/05).
+    
+    Posts are selected by their creation date (in UTC) with a range query on
+    the blog post index, the number of posts per month is taken from the 
+    precomputed archive (if no permission policy hides single posts)."""
+    
+    implements(IRequestHandler)
+    
+    # IRequestHandler
+    def match_request(self, req):
+        match = _archive_path.match(req.path_info)
+        if match is None:
+            return False
+        year, month = match.groups()
+        # month_range() needs the year after the archived one as well
+        if not (1 <= int(year) < datetime.MAXYEAR):
+            return False
+        if month is not None and not (1 <= int(month) <= 12):
+            return False
+        req.args['year'] = int(year)
+        req.args['month'] = month and int(month)
+        return True
+    
+    def process_request(self, req):
+        year, month = req.args['year'], req.args['month']
+        index = BlogPostIndex(self.env)
+        start, end = month_range(year, month)
+        pagenames = index.visible_post_names_between(req, start, end)
+        posts = []
+        for post in index.get_posts(pagenames):
+            posts.append(dict(
+                title = post.title or post.name,
+                url = req.href.wiki(post.name),
+                creation_date = format_datetime(post.created),
+            ))
+        
+        months = []
+        archive = (month is None) and index.visible_archive(req) or []
+        for archive_year, archive_month, number_of_posts in archive:
+            if archive_year != year:
+                continue
+            months.append(dict(
+                label = self._month_label(archive_year, archive_month),
+                href = req.href.blog('archive', year, '%02d' % archive_month),
+                posts = number_of_posts,
+            ))
+        
+        if month is None:
+            archive_title = _('Blog Posts in %(year)d', year=year)
+        else:
+            archive_title = _('Blog Posts in %(month)s', 
+                              month=self._month_label(year, month))
+        add_stylesheet(req, 'blog/css/blog.css')
+        data = dict(
+            archive_title = archive_title,
+            no_posts_title = _('No blog posts were written in this period.'),
+            months = months,
+            posts = posts,
+        )
+        return 'blog_archive.html', data, None
+    
+    def _month_label(self, year, month):
+        return format_datetime(month_range(year, month)[0], '%B %Y', utc)
+
+
+
 class NewPostTagInterface(WikiTagInterface):
     """Adds trac tags for the new blog post page."""
     